@@ -1,16 +1,29 @@
 from .base import Base, metadata
-from .database import Aerie
-from .exceptions import AerieError, NoResultsError, TooManyResultsError
-from .paginator import Page
+from .cache import CacheBackend, MemoryCache
+from .database import Aerie, CopyResult
+from .exceptions import AerieError, NoResultsError, NotSupportedError, ShardingError, TooManyResultsError
+from .paginator import CursorPage, Page
+from .queries import BatchProgress
 from .session import DbSession
+from .sharding import HashRing, RangeMap, ShardedAerie
 
 __all__ = [
     'Aerie',
+    'CopyResult',
     'DbSession',
     'TooManyResultsError',
     'NoResultsError',
     'AerieError',
+    'NotSupportedError',
+    'ShardingError',
     'Page',
+    'CursorPage',
+    'BatchProgress',
     'metadata',
     'Base',
+    'MemoryCache',
+    'CacheBackend',
+    'ShardedAerie',
+    'HashRing',
+    'RangeMap',
 ]
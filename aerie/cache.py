@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+import time
+import typing as t
+from collections import OrderedDict
+from sqlalchemy.engine import Dialect
+from sqlalchemy.sql import ClauseElement, Executable
+
+from aerie.utils import get_table_names
+
+
+class _Entry(t.NamedTuple):
+    value: t.Any
+    expires_at: float
+    tags: t.FrozenSet[str]
+
+
+class CacheOptions(t.NamedTuple):
+    ttl: t.Optional[float] = None
+    key: t.Optional[str] = None
+    tags: t.Tuple[str, ...] = ()
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """A share of lookups served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return f'<CacheStats: hits={self.hits}, misses={self.misses}>'
+
+
+class CacheBackend:
+    """Base class for cache backends.
+
+    Entries are tagged by the names of tables they were computed from,
+    so writes to a table can drop all dependent entries."""
+
+    async def get(self, key: str, default: t.Any = None) -> t.Any:
+        raise NotImplementedError()
+
+    async def set(self, key: str, value: t.Any, ttl: float = None, tags: t.Iterable[str] = ()) -> None:
+        raise NotImplementedError()
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError()
+
+    async def invalidate(self, *tags: str) -> None:
+        """Remove all entries tagged with any of `tags`."""
+        raise NotImplementedError()
+
+    async def clear(self) -> None:
+        raise NotImplementedError()
+
+
+class MemoryCache(CacheBackend):
+    """An in-process LRU cache with TTL and tag based invalidation."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._tags: t.Dict[str, t.Set[str]] = {}
+
+    async def get(self, key: str, default: t.Any = None) -> t.Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return default
+        self._entries.move_to_end(key)
+        return entry.value
+
+    async def set(self, key: str, value: t.Any, ttl: float = None, tags: t.Iterable[str] = ()) -> None:
+        self._remove(key)
+        entry = _Entry(value, time.monotonic() + (self.ttl if ttl is None else ttl), frozenset(tags))
+        self._entries[key] = entry
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    async def delete(self, key: str) -> None:
+        self._remove(key)
+
+    async def invalidate(self, *tags: str) -> None:
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def make_cache_key(
+    prefix: str, stmt: t.Union[ClauseElement, Executable], params: t.Mapping = None, dialect: Dialect = None
+) -> str:
+    """Build a cache key from the compiled statement and its bound parameters."""
+    compiled = t.cast(ClauseElement, stmt).compile(dialect=dialect)
+    params = {**compiled.params, **(params or {})}
+    digest = hashlib.sha1(f'{compiled}:{sorted(params.items())!r}'.encode()).hexdigest()
+    return f'{prefix}:{digest}'
+
+
+def make_result_cache_entry(
+    options: CacheOptions, stmt: Executable, params: t.Mapping = None, dialect: Dialect = None
+) -> t.Tuple[str, t.Set[str]]:
+    """Return a cache key and tags for the result of the statement.
+    The result is tagged with the tables the statement reads from, the custom key and custom tags."""
+    prefix = f'aerie:result:{options.key}' if options.key else 'aerie:result'
+    tags = {*get_table_names(stmt), *options.tags, *([options.key] if options.key else [])}
+    return make_cache_key(prefix, stmt, params, dialect), tags
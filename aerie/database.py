@@ -1,21 +1,63 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars as cv
+import time
 import typing as t
-from sqlalchemy import MetaData
-from sqlalchemy.engine import Row
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from contextlib import asynccontextmanager, nullcontext
+from sqlalchemy import MetaData, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Row
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import Executable
 
-from aerie.base import metadata as shared_metadata
-from aerie.results import ResultProxy
+from aerie.base import Base, metadata as shared_metadata
+from aerie.cache import CacheBackend, MemoryCache
+from aerie.queries import SelectQuery
+from aerie.replicas import ReplicaRouter, RoutingSession
+from aerie.results import ResultProxy, _Writer
 from aerie.schema import Schema
 from aerie.session import DbSession
+from aerie.utils import achunked, gather_or_cancel
 
 _IsolationLevel = t.Literal['SERIALIZABLE', 'REPEATABLE READ', 'READ COMMITTED', 'READ UNCOMMITTED', 'AUTOCOMMIT']
 
 E = t.TypeVar('E', bound=Row)
 
+_Gatherable = t.Union[ResultProxy, SelectQuery, t.Callable[[DbSession], t.Awaitable[t.Any]]]
+_Record = t.Union[t.Sequence[t.Any], t.Mapping[str, t.Any]]
+
+
+async def _as_tuples(
+    first_chunk: t.List[_Record], chunks: t.AsyncIterator[t.List[_Record]], columns: t.Sequence[str]
+) -> t.AsyncGenerator[t.Tuple[t.Any, ...], None]:
+    """Convert records of the first chunk and following chunks to tuples of values in the order of `columns`."""
+
+    def as_tuple(record: _Record) -> t.Tuple[t.Any, ...]:
+        if isinstance(record, t.Mapping):
+            return tuple(record[column] for column in columns)
+        return tuple(record)
+
+    for record in first_chunk:
+        yield as_tuple(record)
+    async for chunk in chunks:
+        for record in chunk:
+            yield as_tuple(record)
+
+
+class CopyResult(t.NamedTuple):
+    rows: int
+    """A number of inserted rows."""
+    elapsed: float
+    """Time spent in seconds."""
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return f'{self.rows} rows in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)'
+
 
 class Aerie:
     instances: t.Dict[str, Aerie] = {}
@@ -31,6 +73,9 @@ class Aerie:
         name: str = None,
         session_class: t.Type[DbSession] = DbSession,
         session_kwargs: t.Dict[str, t.Any] = None,
+        cache: CacheBackend = None,
+        replicas: t.Sequence[str] = None,
+        sticky_window: float = 5,
         **engine_kwargs: t.Any,
     ) -> None:
         if name is not None:
@@ -48,26 +93,277 @@ class Aerie:
             json_deserializer=json_deserializer,
             **engine_kwargs,
         )
+        self.replicas: t.List[AsyncEngine] = [
+            create_async_engine(
+                replica_url,
+                echo=echo,
+                isolation_level=isolation_level,
+                json_serializer=json_serializer,
+                json_deserializer=json_deserializer,
+                **engine_kwargs,
+            )
+            for replica_url in replicas or []
+        ]
+        self.router = ReplicaRouter(self.engine, self.replicas, sticky_window) if self.replicas else None
         self.schema = Schema(self.engine, self.metadata)
+        self._current_connection: cv.ContextVar[t.Optional[AsyncConnection]] = cv.ContextVar(
+            f'aerie_connection_{id(self)}', default=None
+        )
+        self._written_tables: cv.ContextVar[t.Optional[t.Set[str]]] = cv.ContextVar(
+            f'aerie_written_tables_{id(self)}', default=None
+        )
+        self.cache = cache if cache is not None else MemoryCache()
 
         session_kwargs = session_kwargs or {}
+        if self.router is not None:
+            session_kwargs = {'sync_session_class': RoutingSession, 'router': self.router, **session_kwargs}
         self._session_maker: sessionmaker = sessionmaker(
             bind=self.engine,
             class_=session_class,
             expire_on_commit=False,
+            cache=self.cache,
             **session_kwargs,
         )
 
     def session(self, **options: t.Any) -> t.AsyncContextManager[DbSession]:
         return self._session_maker(**options)
 
-    def transaction(self) -> AsyncEngine._trans_ctx:
-        """Establish a new transaction."""
-        return self.engine.begin()
+    @asynccontextmanager
+    async def transaction(self) -> t.AsyncGenerator[AsyncConnection, None]:
+        """Establish a new transaction on the primary database.
+        When replicas are configured, reads of this context go to the primary until `sticky_window` seconds
+        after the transaction ends, so they see its writes."""
+        self._mark_write()
+        async with self.engine.begin() as connection:
+            yield connection
+        self._mark_write()
 
     def execute(self, stmt: t.Union[str, Executable], params: t.Mapping = None) -> ResultProxy:
-        """Execute an executable or raw SQL query."""
-        return ResultProxy(self.engine, stmt, params)
+        """Execute an executable or raw SQL query.
+        When replicas are configured, SELECT statements are executed by a replica, see `ReplicaRouter`."""
+        stmt = text(stmt) if isinstance(stmt, str) else stmt
+        connection = self._current_connection.get()
+        if connection is not None or self.router is None:
+            return ResultProxy(
+                self.engine,
+                stmt,
+                params,
+                cache=self.cache,
+                connection=connection,
+                written_tables=self._written_tables.get(),
+            )
+
+        engine = self.router.get_engine(stmt)
+        fallback_engine = None if engine is self.engine else self.engine
+        return ResultProxy(engine, stmt, params, cache=self.cache, fallback_engine=fallback_engine)
+
+    def use_primary(self) -> t.ContextManager[None]:
+        """Send all reads of this context to the primary database."""
+        if self.router is None:
+            return nullcontext()
+        return self.router.use_primary()
+
+    @asynccontextmanager
+    async def connection(self, autocommit: bool = True) -> t.AsyncGenerator[Aerie, None]:
+        """Execute all statements of this scope, made via `Aerie.execute`, using one connection.
+        This saves a pool checkout per statement.
+
+        With `autocommit`, statements are executed without BEGIN and COMMIT, which is the fastest way to run reads.
+        Otherwise, each statement runs in its own transaction.
+        The connection must not be used by concurrent tasks."""
+        if self._current_connection.get() is not None:
+            yield self
+            return
+
+        async with self.engine.connect() as connection:
+            if autocommit:
+                await connection.execution_options(isolation_level='AUTOCOMMIT')
+            token = self._current_connection.set(connection)
+            try:
+                yield self
+            finally:
+                self._current_connection.reset(token)
+
+    @asynccontextmanager
+    async def batch(self, snapshot: bool = False, readonly: bool = False) -> t.AsyncGenerator[Aerie, None]:
+        """Execute all statements of this scope, made via `Aerie.execute`, using one connection and one transaction.
+        The transaction is committed on exit, or rolled back if an exception is raised.
+        Cached results of modified tables are invalidated after the commit.
+
+        With `snapshot`, all statements see the same snapshot of the database:
+        PostgreSQL transaction uses REPEATABLE READ isolation level,
+        on SQLite the transaction is started explicitly before the first statement.
+        With `readonly`, PostgreSQL transaction is started in READ ONLY mode, and a replica is used if configured.
+        The connection must not be used by concurrent tasks. Nested batches join the outer one.
+
+        Inside `connection()` scope, the transaction is started on the shared connection,
+        `snapshot` and `readonly` cannot be applied to it and raise `ValueError`."""
+        connection = self._current_connection.get()
+        if connection is not None and connection.in_transaction():
+            yield self  # join the outer batch
+            return
+        if connection is not None:
+            if snapshot or readonly:
+                raise ValueError('Snapshot and read-only batches cannot be started inside connection() scope.')
+            async with self._shared_transaction(connection):
+                yield self
+            return
+
+        options: t.Dict[str, t.Any] = {}
+        if self.engine.dialect.name == 'postgresql':
+            if snapshot:
+                options['isolation_level'] = 'REPEATABLE READ'
+            if readonly:
+                options['postgresql_readonly'] = True
+
+        engine = self.engine
+        if readonly and self.router is not None:
+            engine = self.router.choose_replica() or self.engine
+
+        async with engine.connect() as connection:
+            if options:
+                await connection.execution_options(**options)
+            # the driver does not begin SQLite transactions before SELECT statements
+            explicit_begin = snapshot and self.engine.dialect.name == 'sqlite'
+            async with self._transaction(connection, explicit_begin=explicit_begin, readonly=readonly):
+                yield self
+
+    def _mark_write(self) -> None:
+        if self.router is not None:
+            self.router.mark_write()
+
+    @asynccontextmanager
+    async def _shared_transaction(self, connection: AsyncConnection) -> t.AsyncGenerator[None, None]:
+        """Run a transaction on the connection of `connection()` scope, which may be in AUTOCOMMIT mode."""
+        options = t.cast(Connection, connection.sync_connection).get_execution_options()
+        autocommit = options.get('isolation_level') == 'AUTOCOMMIT'
+        if autocommit:
+            await connection.execution_options(isolation_level=connection.default_isolation_level)
+        try:
+            async with self._transaction(connection):
+                yield
+        finally:
+            if autocommit:
+                await connection.execution_options(isolation_level='AUTOCOMMIT')
+
+    @asynccontextmanager
+    async def _transaction(
+        self, connection: AsyncConnection, explicit_begin: bool = False, readonly: bool = False
+    ) -> t.AsyncGenerator[None, None]:
+        """Share the connection and its transaction with `Aerie.execute` calls of this scope.
+        Tables modified in the transaction are invalidated in the cache once it commits,
+        so concurrent readers cannot cache uncommitted rows.
+        Unless the transaction is read-only, following reads of this context are sent to the primary."""
+        if not readonly:
+            self._mark_write()
+        written_tables: t.Set[str] = set()
+        async with connection.begin():
+            if explicit_begin:
+                await connection.exec_driver_sql('BEGIN')
+            connection_token = self._current_connection.set(connection)
+            tables_token = self._written_tables.set(written_tables)
+            try:
+                yield
+            finally:
+                self._current_connection.reset(connection_token)
+                self._written_tables.reset(tables_token)
+        if not readonly:
+            self._mark_write()
+        if written_tables:
+            await self.cache.invalidate(*written_tables)
+
+    async def copy_in(
+        self,
+        table: t.Union[Table, t.Type[Base]],
+        records: t.Union[t.Iterable[_Record], t.AsyncIterable[_Record]],
+        columns: t.Sequence[str] = None,
+        batch_size: int = 10_000,
+    ) -> CopyResult:
+        """Bulk load records into the table. Records are consumed lazily, so they can be streamed from a generator.
+        A record is either a sequence of values in the order of `columns` (all table columns by default),
+        or a mapping of column names to values (`columns` default to keys of the first record).
+
+        On asyncpg, records are sent with a single `COPY ... FROM STDIN` command.
+        Other drivers insert records with executemany, one call per `batch_size` records, in one transaction."""
+        target: Table = table if isinstance(table, Table) else inspect(table).local_table
+        started_at = time.perf_counter()
+        chunks = achunked(records, batch_size)  # accepts both sync and async iterables
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = []
+        if columns is None and first_chunk and isinstance(first_chunk[0], t.Mapping):
+            columns = list(first_chunk[0])
+        columns = list(columns or [column.name for column in target.columns])
+
+        rows = 0
+        if self.engine.dialect.driver == 'asyncpg':
+            async with self.engine.connect() as connection:
+                raw_connection = await connection.get_raw_connection()
+                status = await raw_connection.driver_connection.copy_records_to_table(
+                    target.name,
+                    records=_as_tuples(first_chunk, chunks, columns),
+                    columns=columns,
+                    schema_name=target.schema,
+                )
+                rows = int(status.split()[-1])  # "COPY <rows>"
+        else:
+            async with self.engine.begin() as connection:
+                async for chunk in achunked(_as_tuples(first_chunk, chunks, columns), batch_size):
+                    await connection.execute(target.insert(), [dict(zip(columns, record)) for record in chunk])
+                    rows += len(chunk)
+
+        await self.cache.invalidate(target.fullname)
+        return CopyResult(rows=rows, elapsed=time.perf_counter() - started_at)
+
+    async def copy_out(
+        self,
+        source: t.Union[Table, t.Type[Base], Executable, str],
+        writer: _Writer,
+        format: t.Literal['csv', 'ndjson'] = 'csv',
+        batch_size: int = 1000,
+    ) -> int:
+        """Export all rows of a table, a model or a query to `writer` in CSV or NDJSON format.
+        Returns a number of exported rows. See `ResultProxy.to_csv` and `ResultProxy.to_ndjson` for details."""
+        stmt: t.Union[Executable, str]
+        if isinstance(source, type):
+            stmt = select(inspect(source).local_table)
+        elif isinstance(source, Table):
+            stmt = select(source)
+        else:
+            stmt = source
+
+        result = self.execute(stmt)
+        if format == 'ndjson':
+            return await result.to_ndjson(writer, batch_size=batch_size)
+        return await result.to_csv(writer, batch_size=batch_size)
+
+    async def gather(self, *queries: _Gatherable, limit: int = 4) -> t.List[t.Any]:
+        """Run independent queries concurrently, at most `limit` at a time, and return their results in order.
+
+        Queries are `ResultProxy` (resolves to rows), `SelectQuery` (resolves to entities)
+        or callables receiving a new session and returning an awaitable.
+        Each query uses its own connection (and session), so results are not bound to the caller's session.
+        When a query fails, other queries are cancelled and the exception is raised."""
+        if limit < 1:
+            raise ValueError('Concurrency limit must be greater than zero.')
+        if not queries:
+            return []
+
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(query: _Gatherable) -> t.Any:
+            async with semaphore:
+                if isinstance(query, ResultProxy):
+                    return await query._clone().all()
+
+                DbSession.current_session_stack.set([])  # do not share the stack with sibling tasks
+                async with self.session() as session:
+                    if isinstance(query, SelectQuery):
+                        return await query._clone(executor=session).all()
+                    return await query(session)
+
+        return await gather_or_cancel(run(query) for query in queries)
 
     @classmethod
     def get_instance(cls, name: str = 'default') -> Aerie:
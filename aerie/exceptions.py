@@ -15,3 +15,15 @@ class NoResultsError(AerieError, exc.NoResultFound):  # pragma: no cover
 
 class NoActiveSessionError(AerieError):  # pragma: no cover
     """Raised when not global session exists."""
+
+
+class InvalidCursorError(AerieError, ValueError):  # pragma: no cover
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class NotSupportedError(AerieError):  # pragma: no cover
+    """Raised when the database does not support the requested feature."""
+
+
+class ShardingError(AerieError):  # pragma: no cover
+    """Raised when a shard cannot be chosen."""
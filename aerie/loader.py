@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+import typing as t
+
+K = t.TypeVar('K')
+V = t.TypeVar('V')
+
+BatchLoadFn = t.Callable[[t.List[K]], t.Awaitable[t.Mapping[K, V]]]
+
+
+class BatchLoader(t.Generic[K, V]):
+    """Coalesces keys requested by concurrent tasks into a single batch load.
+
+    Keys requested within one event loop iteration (or within `delay` seconds after the first one)
+    are de-duplicated and passed to `load_fn` at once. It must return a mapping of keys to values,
+    keys missing in the mapping resolve to None."""
+
+    def __init__(self, load_fn: BatchLoadFn[K, V], delay: float = 0) -> None:
+        self.load_fn = load_fn
+        self.delay = delay
+        self._pending: t.Dict[K, asyncio.Future[t.Optional[V]]] = {}
+        self._scheduled = False
+
+    async def load(self, key: K) -> t.Optional[V]:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_later(self.delay, self._dispatch)
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: t.Iterable[K]) -> t.List[t.Optional[V]]:
+        return list(await asyncio.gather(*[self.load(key) for key in keys]))
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+        asyncio.ensure_future(self._resolve(pending))
+
+    async def _resolve(self, pending: t.Dict[K, asyncio.Future[t.Optional[V]]]) -> None:
+        try:
+            values = await self.load_fn(list(pending))
+        except Exception as ex:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ex)
+            return
+
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(values.get(key))
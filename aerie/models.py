@@ -1,15 +1,25 @@
 import sqlalchemy as sa
 import typing as t
 from sqlalchemy import Boolean, inspect
-from sqlalchemy.sql import ColumnElement
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import CursorResult
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import ColumnElement, Insert
 
 from aerie.base import Base
+from aerie.cache import CacheStats
 from aerie.collections import Collection
+from aerie.exceptions import NoResultsError
+from aerie.loader import BatchLoader
 from aerie.queries import SelectQuery
-from aerie.session import get_current_session
+from aerie.session import DbSession, get_current_session
+from aerie.utils import LARGE_IN_THRESHOLD, chunked, get_dialect_insert, in_conditions, supports_returning
 
 C = t.TypeVar('C', bound='BaseModel')
 
+_entity_cache_stats: t.Dict[type, CacheStats] = {}
+
 
 class AutoIntegerId:
     __abstract__ = True
@@ -28,6 +38,12 @@ class _QueryProperty(t.Generic[C]):
 
 class BaseModel(Base):
     __abstract__ = True
+    __cache__: t.ClassVar[bool] = False
+    """Cache entities loaded by `get` and `get_or_none` in the Aerie cache, shared by all sessions."""
+    __cache_ttl__: t.ClassVar[t.Optional[float]] = None
+    """Time to live of cached entities, the cache backend default is used when not set."""
+    __batch_loads__: t.ClassVar[bool] = False
+    """Coalesce `get` and `get_or_none` calls made by concurrent tasks into one `WHERE pk IN (...)` query."""
 
     @classmethod
     def query(cls: t.Type[C]) -> SelectQuery[C]:
@@ -43,22 +59,123 @@ class BaseModel(Base):
 
     @classmethod
     async def get(cls: t.Type[C], pk: t.Any, pk_column: str = 'id') -> C:
+        if cls._uses_entity_cache(pk_column):
+            instance = await cls._get_cached(pk, pk_column)
+            if instance is None:
+                raise NoResultsError('No rows found when one was required.')
+            return instance
+
+        if cls.__batch_loads__:
+            instance = await cls.loader(pk_column).load(pk)
+            if instance is None:
+                raise NoResultsError('No rows found when one was required.')
+            return instance
+
         column = getattr(cls, pk_column)
         return await cls.query().where(column == pk).one()
 
     @classmethod
     async def get_or_none(cls: t.Type[C], pk: t.Any, pk_column: str = 'id') -> t.Optional[C]:
+        if cls._uses_entity_cache(pk_column):
+            return await cls._get_cached(pk, pk_column)
+
+        if cls.__batch_loads__:
+            return await cls.loader(pk_column).load(pk)
+
         column = getattr(cls, pk_column)
         return await cls.query().where(column == pk).one_or_none()
 
+    @classmethod
+    async def get_many(
+        cls: t.Type[C], keys: t.Iterable[t.Any], pk_column: str = 'id', order: t.Literal['input', 'pk'] = 'input'
+    ) -> t.List[C]:
+        """Load entities by a list of keys, missing ones are skipped.
+        Entities are returned in the order of `keys` or sorted by key when `order` is "pk".
+
+        Long lists of keys do not hit the database limit on bound parameters,
+        see `aerie.utils.in_conditions` for details."""
+        instances = await cls.get_many_dict(keys, pk_column)
+        if order == 'pk':
+            return [instances[key] for key in sorted(instances)]
+        return [instances[key] for key in dict.fromkeys(keys) if key in instances]
+
+    @classmethod
+    async def get_many_dict(cls: t.Type[C], keys: t.Iterable[t.Any], pk_column: str = 'id') -> t.Dict[t.Any, C]:
+        """Load entities by a list of keys and map them by key, missing ones are skipped."""
+        instances = await cls._load_by_keys([pk_column], [(key,) for key in dict.fromkeys(keys)], refresh=False)
+        return {key[0]: instance for key, instance in instances.items()}
+
+    @classmethod
+    def loader(cls: t.Type[C], pk_column: str = 'id') -> BatchLoader[t.Any, C]:
+        """Return the batch loader of this model bound to the current session.
+
+        Keys requested by concurrent tasks within one event loop iteration
+        are loaded by a single `WHERE pk_column IN (...)` query."""
+        session = get_current_session()
+        loader = session.loaders.get((cls, pk_column))
+        if loader is None:
+
+            async def load(keys: t.List[t.Any]) -> t.Dict[t.Any, C]:
+                # the batch is dispatched later, when another session may be current
+                instances = await cls._load_by_keys(
+                    [pk_column], [(key,) for key in keys], refresh=False, session=session
+                )
+                return {key[0]: instance for key, instance in instances.items()}
+
+            loader = session.loaders[(cls, pk_column)] = BatchLoader(load)
+        return loader
+
+    @classmethod
+    def cache_stats(cls) -> CacheStats:
+        """Return hit and miss counters of the entity cache of this model."""
+        return _entity_cache_stats.setdefault(cls, CacheStats())
+
+    @t.overload
     @classmethod
     async def get_or_create(
         cls: t.Type[C],
-        where: ColumnElement[Boolean],
+        where: t.Optional[ColumnElement[Boolean]],
         values: t.Mapping[str, t.Any],
         autoflush: bool = True,
         autocommit: bool = False,
-    ) -> C:
+        conflict: None = None,
+    ) -> C:  # pragma: no cover
+        ...
+
+    @t.overload
+    @classmethod
+    async def get_or_create(
+        cls: t.Type[C],
+        where: t.Optional[ColumnElement[Boolean]],
+        values: t.Mapping[str, t.Any],
+        autoflush: bool = True,
+        autocommit: bool = False,
+        *,
+        conflict: t.Sequence[str],
+    ) -> t.Tuple[C, bool]:  # pragma: no cover
+        ...
+
+    @classmethod
+    async def get_or_create(
+        cls: t.Type[C],
+        where: t.Optional[ColumnElement[Boolean]],
+        values: t.Mapping[str, t.Any],
+        autoflush: bool = True,
+        autocommit: bool = False,
+        conflict: t.Sequence[str] = None,
+    ) -> t.Union[C, t.Tuple[C, bool]]:
+        """Load the row matching `where` or create a new one from `values`.
+
+        This takes two queries and is not safe under concurrent calls for the same key.
+        Pass `conflict` to insert the row with a single `INSERT ... ON CONFLICT DO NOTHING` statement instead,
+        `where` is ignored then and a tuple of the entity and a flag telling whether the row was created is returned.
+        The row is inserted by the statement itself, so `autoflush` does not apply, see `get_or_create_many`."""
+        if conflict is not None:
+            [(entity, created)] = await cls.get_or_create_many([values], conflict=conflict, commit=autocommit)
+            return entity, created
+        if where is None:
+            raise ValueError('Pass either "where" or "conflict" argument.')
+
         instance = await cls.query().where(where).one_or_none()
         if not instance:
             instance = await cls.create(autoflush=autoflush, autocommit=autocommit, **values)
@@ -74,20 +191,379 @@ class BaseModel(Base):
         return instance
 
     @classmethod
-    async def destroy(cls, *pk: t.Any, pk_column: str = 'id') -> None:
+    async def bulk_create(
+        cls: t.Type[C],
+        rows: t.Iterable[t.Mapping[str, t.Any]],
+        batch_size: int = 500,
+        return_instances: bool = True,
+        commit: bool = False,
+    ) -> t.List[C]:
+        """Insert rows using one multi-row INSERT statement per `batch_size` rows.
+        All rows must have the same keys.
+
+        When the database supports RETURNING, instances are built from the returned rows
+        and attached to the session without extra queries, otherwise they are inserted by the ORM.
+        Set `return_instances` to False to insert rows with executemany and skip creating instances."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        use_returning = supports_returning(session.bind.dialect)
+        instances: t.List[C] = []
+        for batch in chunked(rows, batch_size):
+            if not return_instances:
+                await session.execute(sa.insert(cls), batch)
+            elif use_returning:
+                columns = list(mapper.local_table.columns)
+                for row in await session.execute(sa.insert(cls).values(batch).returning(*columns)):
+                    instance = cls._build_detached(
+                        {mapper.get_property_by_column(column).key: value for column, value in zip(columns, row)}
+                    )
+                    session.add(instance)
+                    instances.append(instance)
+            else:
+                batch_instances = [cls(**row) for row in batch]  # type: ignore[call-arg]
+                session.add_all(batch_instances)
+                await session.flush(batch_instances)
+                instances.extend(batch_instances)
+
+        await session.invalidate_cache(*[table.fullname for table in mapper.tables])
+        if commit:
+            await session.commit()
+        return instances
+
+    @classmethod
+    async def bulk_update(
+        cls,
+        mappings: t.Iterable[t.Mapping[str, t.Any]],
+        fields: t.Sequence[str] = None,
+        pk_column: str = 'id',
+        batch_size: int = 500,
+        commit: bool = False,
+    ) -> int:
+        """Update rows with individual values using one statement per `batch_size` mappings.
+        Each mapping contains a primary key and new values of `fields` (all keys except the primary key by default).
+        Returns a number of updated rows.
+
+        On PostgreSQL, a batch is applied by `UPDATE ... FROM unnest(...)` statement,
+        other databases execute `UPDATE ... WHERE pk = ?` statement with executemany.
+        Entities which are already in the session receive new values."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        table = mapper.local_table
+        pk = mapper.attrs[pk_column].columns[0]
+        updated = 0
+        for batch in chunked(mappings, batch_size):
+            keys = list(fields or [key for key in batch[0] if key != pk_column])
+            columns = [mapper.attrs[key].columns[0] for key in keys]
+            if session.bind.dialect.name == 'postgresql':
+                # one array parameter per column, so the statement does not depend on the batch size
+                data = (
+                    sa.func.unnest(
+                        *[
+                            sa.cast(
+                                sa.bindparam(None, [row[key] for row in batch], type_=ARRAY(column.type)),
+                                ARRAY(column.type),
+                            )
+                            for key, column in zip([pk_column, *keys], [pk, *columns])
+                        ]
+                    )
+                    .table_valued(*[column.key for column in [pk, *columns]])
+                    .render_derived(name='data')
+                )
+                stmt = (
+                    sa.update(table)
+                    .where(pk == data.c[pk.key])
+                    .values({column.key: data.c[column.key] for column in columns})
+                )
+                result = await session.execute(stmt)
+            else:
+                stmt = (
+                    sa.update(table)
+                    .where(pk == sa.bindparam('_pk'))
+                    .values({column.key: sa.bindparam(f'_{column.key}') for column in columns})
+                )
+                params = [
+                    {'_pk': row[pk_column], **{f'_{column.key}': row[key] for key, column in zip(keys, columns)}}
+                    for row in batch
+                ]
+                result = await session.execute(stmt, params)
+            updated += t.cast(CursorResult, result).rowcount
+
+            if len(mapper.primary_key) == 1 and mapper.primary_key[0] is pk:
+                for row in batch:
+                    instance = session.identity_map.get(mapper.identity_key_from_primary_key([row[pk_column]]))
+                    if instance is not None:
+                        for key in keys:
+                            set_committed_value(instance, key, row[key])
+
+        await session.invalidate_cache(*[table.fullname for table in mapper.tables])
+        if commit:
+            await session.commit()
+        return updated
+
+    @classmethod
+    async def upsert(
+        cls: t.Type[C],
+        values: t.Mapping[str, t.Any],
+        conflict: t.Sequence[str] = None,
+        update: t.Sequence[str] = None,
+        commit: bool = False,
+    ) -> C:
+        """Insert a row or update the existing one using `INSERT ... ON CONFLICT DO UPDATE` statement.
+        See `upsert_many` for arguments."""
+        instances = await cls.upsert_many([values], conflict=conflict, update=update, commit=commit)
+        return instances[0]
+
+    @classmethod
+    async def upsert_many(
+        cls: t.Type[C],
+        rows: t.Iterable[t.Mapping[str, t.Any]],
+        conflict: t.Sequence[str] = None,
+        update: t.Sequence[str] = None,
+        batch_size: int = 500,
+        commit: bool = False,
+    ) -> t.List[C]:
+        """Insert rows or update existing ones using one `INSERT ... ON CONFLICT DO UPDATE` statement
+        per `batch_size` rows. Returns affected entities in the order of rows.
+
+        `conflict` names columns of the unique index used to detect existing rows (primary key by default),
+        rows must have the same keys and include these columns.
+        `update` names columns to overwrite in existing rows, by default all given columns except conflict ones.
+
+        When the database does not support RETURNING, affected rows are loaded by an extra SELECT per batch."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        dialect = session.bind.dialect
+        insert = get_dialect_insert(dialect)
+        conflict_keys = cls._conflict_keys(conflict)
+        instances: t.List[C] = []
+        for batch in chunked(rows, batch_size):
+            update_keys = update if update is not None else [key for key in batch[0] if key not in conflict_keys]
+            stmt = insert(mapper.local_table).values([cls._to_column_values(row) for row in batch])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[mapper.attrs[key].columns[0] for key in conflict_keys],
+                # an empty update list still has to touch the row, otherwise it is not returned
+                set_={
+                    column.key: stmt.excluded[column.key]
+                    for column in [mapper.attrs[key].columns[0] for key in update_keys or conflict_keys]
+                },
+            )
+
+            keys = [tuple(row[key] for key in conflict_keys) for row in batch]
+            if supports_returning(dialect):
+                affected = {
+                    tuple(getattr(instance, key) for key in conflict_keys): instance
+                    for instance in await cls._execute_returning(stmt)
+                }
+            else:
+                await session.execute(stmt)
+                affected = await cls._load_by_keys(conflict_keys, keys)
+            instances.extend(affected[key] for key in keys)
+
+        await session.invalidate_cache(*[table.fullname for table in mapper.tables])
+        if commit:
+            await session.commit()
+        return instances
+
+    @classmethod
+    async def get_or_create_many(
+        cls: t.Type[C],
+        rows: t.Iterable[t.Mapping[str, t.Any]],
+        conflict: t.Sequence[str] = None,
+        batch_size: int = 500,
+        commit: bool = False,
+    ) -> t.List[t.Tuple[C, bool]]:
+        """Load existing rows or insert missing ones using one `INSERT ... ON CONFLICT DO NOTHING` statement
+        per `batch_size` rows. Returns tuples of an entity and a flag telling whether the row was created,
+        in the order of rows.
+
+        `conflict` names columns of the unique index used to detect existing rows (primary key by default),
+        rows must have the same keys and include these columns.
+        Concurrent calls for the same keys do not fail on the unique index, existing rows are never modified.
+
+        When the database supports RETURNING, existing rows are loaded only if some rows of the batch conflict.
+        Otherwise, rows are inserted one by one, the number of inserted rows tells whether each one was created,
+        and all rows of the batch are loaded after that."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        dialect = session.bind.dialect
+        insert = get_dialect_insert(dialect)
+        conflict_keys = cls._conflict_keys(conflict)
+        index_elements = [mapper.attrs[key].columns[0] for key in conflict_keys]
+        results: t.List[t.Tuple[C, bool]] = []
+        for batch in chunked(rows, batch_size):
+            keys = [tuple(row[key] for key in conflict_keys) for row in batch]
+            if supports_returning(dialect):
+                stmt = insert(mapper.local_table).values([cls._to_column_values(row) for row in batch])
+                stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+                created = {
+                    tuple(getattr(instance, key) for key in conflict_keys): instance
+                    for instance in await cls._execute_returning(stmt)
+                }
+                instances = dict(created)
+                missing = [key for key in keys if key not in created]
+                if missing:
+                    instances.update(await cls._load_by_keys(conflict_keys, missing))
+            else:
+                # a SELECT before the insert would miss rows inserted concurrently in between
+                created_keys = set()
+                for key, row in zip(keys, batch):
+                    stmt = insert(mapper.local_table).values(cls._to_column_values(row))
+                    result = await session.execute(stmt.on_conflict_do_nothing(index_elements=index_elements))
+                    if t.cast(CursorResult, result).rowcount:
+                        created_keys.add(key)
+                instances = await cls._load_by_keys(conflict_keys, keys)
+                created = {key: instances[key] for key in created_keys}
+            results.extend((instances[key], key in created) for key in keys)
+
+        await session.invalidate_cache(*[table.fullname for table in mapper.tables])
+        if commit:
+            await session.commit()
+        return results
+
+    @classmethod
+    async def destroy(
+        cls,
+        *pk: t.Any,
+        pk_column: str = 'id',
+        batch_size: int = 500,
+        cascade: bool = False,
+        commit: bool = True,
+    ) -> None:
+        """Delete rows by primary keys using `DELETE ... WHERE pk IN (...)` statements, one per `batch_size` keys.
+        All batches are executed in the same transaction.
+
+        When `cascade` is set and the model has relationships with delete cascade,
+        entities are loaded and deleted one by one, so the ORM can process the cascades."""
+        session = get_current_session()
         column = getattr(cls, pk_column)
-        for instance in await cls.query().where(column.in_(pk)).all():
-            await instance.delete()
+        use_orm = cascade and any(relationship.cascade.delete for relationship in inspect(cls).relationships)
+        for batch in chunked(pk, batch_size):
+            for condition in in_conditions(column, batch, session.bind.dialect):
+                if use_orm:
+                    for instance in await cls.query().where(condition).all():
+                        await session.delete(instance)
+                    await session.invalidate_cache(*[table.fullname for table in inspect(cls).tables])
+                else:
+                    await cls.query().where(condition).delete()
+
+        if commit:
+            await session.commit()
+
+    @classmethod
+    def _uses_entity_cache(cls, pk_column: str) -> bool:
+        if not cls.__cache__:
+            return False
+        mapper = inspect(cls)
+        return len(mapper.primary_key) == 1 and mapper.get_property_by_column(mapper.primary_key[0]).key == pk_column
+
+    @classmethod
+    async def _get_cached(cls: t.Type[C], pk: t.Any, pk_column: str) -> t.Optional[C]:
+        """Look up an entity in the session identity map, then in the shared cache and then in the database.
+        Missing entities are cached as well."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        tables = [table.fullname for table in mapper.tables]
+        if session.cache is None or session.has_pending_writes(tables):
+            return await cls.query().where(getattr(cls, pk_column) == pk).one_or_none()
+
+        instance = session.identity_map.get(mapper.identity_key_from_primary_key([pk]))
+        if instance is not None:
+            return instance
+
+        stats = cls.cache_stats()
+        cache_key = f'aerie:entity:{mapper.local_table.fullname}:{pk!r}'
+        values = await session.cache.get(cache_key)
+        if values is not None:
+            stats.hits += 1
+            if values is False:  # the entity does not exist
+                return None
+
+            return await session.merge(cls._build_detached(values), load=False)
+
+        stats.misses += 1
+        instance = await cls.query().where(getattr(cls, pk_column) == pk).one_or_none()
+        if instance is None:
+            values = False
+        else:
+            column_keys = mapper.column_attrs.keys()
+            values = {key: value for key, value in inspect(instance).dict.items() if key in column_keys}
+        await session.cache.set(cache_key, values, ttl=cls.__cache_ttl__, tags=tables)
+        return instance
+
+    @classmethod
+    def _build_detached(cls: t.Type[C], values: t.Mapping[str, t.Any]) -> C:
+        """Create a detached instance from attribute values as if it was loaded from the database."""
+        mapper = inspect(cls)
+        instance = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            if attr.key in values:
+                setattr(instance, attr.key, values[attr.key])
+        make_transient_to_detached(instance)
+        return instance
+
+    @classmethod
+    def _conflict_keys(cls, conflict: t.Optional[t.Sequence[str]]) -> t.List[str]:
+        mapper = inspect(cls)
+        return list(conflict or [mapper.get_property_by_column(column).key for column in mapper.primary_key])
+
+    @classmethod
+    async def _execute_returning(cls: t.Type[C], stmt: Insert) -> t.List[C]:
+        """Execute the statement returning all columns and merge returned rows into the session."""
+        session = get_current_session()
+        mapper = inspect(cls)
+        columns = list(mapper.local_table.columns)
+        return [
+            await session.merge(
+                cls._build_detached(
+                    {mapper.get_property_by_column(column).key: value for column, value in zip(columns, row)}
+                ),
+                load=False,
+            )
+            for row in await session.execute(stmt.returning(*columns))
+        ]
+
+    @classmethod
+    async def _load_by_keys(
+        cls: t.Type[C],
+        attributes: t.Sequence[str],
+        keys: t.Sequence[t.Tuple[t.Any, ...]],
+        refresh: bool = True,
+        session: DbSession = None,
+    ) -> t.Dict[t.Tuple[t.Any, ...], C]:
+        """Load entities by values of `attributes` into `session` (the current one by default)
+        and map them by these values.
+        Entities which are already in the session are refreshed unless `refresh` is False."""
+        session = get_current_session() if session is None else session
+        columns = [getattr(cls, attribute) for attribute in attributes]
+        if len(columns) == 1:
+            conditions = in_conditions(columns[0], [key[0] for key in keys], session.bind.dialect)
+        else:
+            conditions = (sa.tuple_(*columns).in_(chunk) for chunk in chunked(keys, LARGE_IN_THRESHOLD))
+
+        instances: t.Dict[t.Tuple[t.Any, ...], C] = {}
+        for condition in conditions:
+            result = await session.execute(sa.select(cls).where(condition).execution_options(populate_existing=refresh))
+            for instance in result.scalars():
+                instances[tuple(getattr(instance, attribute) for attribute in attributes)] = instance
+        return instances
+
+    @classmethod
+    def _to_column_values(cls, values: t.Mapping[str, t.Any]) -> t.Dict[str, t.Any]:
+        """Convert attribute names to column keys for Core statements."""
+        mapper = inspect(cls)
+        return {mapper.attrs[key].columns[0].key: value for key, value in values.items()}
 
     async def save(self, commit: bool = True) -> None:
         session = get_current_session()
         session.add(self)  # type: ignore
+        await session.invalidate_cache(*self._table_names())
         if commit:
             await session.commit()
 
     async def delete(self, commit: bool = True) -> None:
         session = get_current_session()
         await session.delete(self)
+        await session.invalidate_cache(*self._table_names())
         if commit:
             await session.commit()
 
@@ -95,6 +571,9 @@ class BaseModel(Base):
         session = get_current_session()
         await session.refresh(self)
 
+    def _table_names(self) -> t.List[str]:
+        return [table.fullname for table in inspect(self).mapper.tables]
+
     def __repr__(self) -> str:
         identity = inspect(self).identity
         if identity is None:
@@ -1,27 +1,61 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import datetime
+import decimal
+import json
 import math
 import typing as t
+import uuid
+
+from aerie.exceptions import InvalidCursorError
 
 M = t.TypeVar('M')
 
+_CURSOR_TYPES: t.Dict[str, t.Tuple[t.Type, t.Callable[[t.Any], str], t.Callable[[str], t.Any]]] = {
+    'dt': (datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    'd': (datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    't': (datetime.time, datetime.time.isoformat, datetime.time.fromisoformat),
+    'dec': (decimal.Decimal, str, decimal.Decimal),
+    'uuid': (uuid.UUID, str, uuid.UUID),
+}
+
 
 class Page(t.Generic[M]):
-    def __init__(self, rows: t.Sequence[M], total_rows: int, page: int, page_size: int) -> None:
+    def __init__(
+        self,
+        rows: t.Sequence[M],
+        total_rows: int,
+        page: int,
+        page_size: int,
+        total_is_exact: bool = True,
+        has_more: t.Optional[bool] = None,
+    ) -> None:
         self.rows = rows
         self.total_rows = total_rows
         self.page = page
         self.page_size = page_size
+        self.total_is_exact = total_is_exact
+        self.has_more = has_more
         self._pointer = 0
 
     @property
     def total_pages(self) -> int:
-        """Total pages in the row set."""
-        return math.ceil(self.total_rows / self.page_size)
+        """Total pages in the row set.
+        When the total is not exact, the value is adjusted to the position of the current page."""
+        total_pages = math.ceil(self.total_rows / self.page_size)
+        if self.total_is_exact or self.has_more is None:
+            return total_pages
+        if self.has_more:
+            return max(total_pages, self.page + 1)
+        return self.page
 
     @property
     def has_next(self) -> bool:
         """Test if the next page is available."""
+        if self.has_more is not None:
+            return self.has_more
         return self.page < self.total_pages
 
     @property
@@ -56,6 +90,8 @@ class Page(t.Generic[M]):
     @property
     def end_index(self) -> int:
         """The 1-based index of the last item on this page."""
+        if not self.total_is_exact:
+            return self.start_index + len(self.rows) - 1
         return min(self.start_index + self.page_size - 1, self.total_rows)
 
     def iter_pages(
@@ -94,9 +130,94 @@ class Page(t.Generic[M]):
         return self.total_pages > 1
 
     def __str__(self) -> str:
-        return (
-            f'Page {self.page} of {self.total_pages}, rows {self.start_index} - {self.end_index} of {self.total_rows}.'
-        )
+        total_rows = str(self.total_rows) if self.total_is_exact else f'{self.total_rows}+'
+        return f'Page {self.page} of {self.total_pages}, rows {self.start_index} - {self.end_index} of {total_rows}.'
 
     def __repr__(self) -> str:
         return f'<Page: page={self.page}, total_pages={self.total_pages}>'
+
+
+class CursorPage(t.Generic[M]):
+    """A page of the keyset paginated row set.
+    Navigation to the adjacent pages is done with opaque `next_cursor` and `previous_cursor` tokens."""
+
+    def __init__(
+        self,
+        rows: t.Sequence[M],
+        page_size: int,
+        next_cursor: t.Optional[str] = None,
+        previous_cursor: t.Optional[str] = None,
+    ) -> None:
+        self.rows = rows
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._pointer = 0
+
+    @property
+    def has_next(self) -> bool:
+        """Test if the next page is available."""
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        """Test if the previous page is available."""
+        return self.previous_cursor is not None
+
+    @property
+    def has_other(self) -> bool:
+        """Test if page has next or previous pages."""
+        return self.has_next or self.has_previous
+
+    def __iter__(self) -> t.Iterator[M]:
+        return iter(self.rows)
+
+    def __next__(self) -> M:
+        if self._pointer == len(self.rows):
+            raise StopIteration
+        self._pointer += 1
+        return self.rows[self._pointer - 1]
+
+    def __getitem__(self, item: int) -> M:
+        return self.rows[item]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __bool__(self) -> bool:
+        """A shortcut to check if page has other pages.
+        Useful in templates to check if the pagination should be rendered or not."""
+        return self.has_other
+
+    def __repr__(self) -> str:
+        return f'<CursorPage: rows={len(self.rows)}, has_next={self.has_next}, has_previous={self.has_previous}>'
+
+
+def _encode_value(value: t.Any) -> t.Any:
+    for tag, (type_, encoder, _) in _CURSOR_TYPES.items():
+        if isinstance(value, type_):
+            return {tag: encoder(value)}
+    return value
+
+
+def _decode_value(value: t.Any) -> t.Any:
+    if isinstance(value, dict):
+        [(tag, encoded)] = value.items()
+        return _CURSOR_TYPES[tag][2](encoded)
+    return value
+
+
+def encode_cursor(values: t.Sequence[t.Any], backwards: bool = False) -> str:
+    """Encode keyset values into an opaque URL safe cursor."""
+    payload = json.dumps({'v': [_encode_value(value) for value in values], 'b': backwards}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> t.Tuple[t.List[t.Any], bool]:
+    """Decode a cursor created by `encode_cursor`.
+    Returns keyset values and the flag whether the cursor points backwards."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return [_decode_value(value) for value in payload['v']], bool(payload['b'])
+    except (binascii.Error, ValueError, TypeError, KeyError) as exc:
+        raise InvalidCursorError(f'Invalid pagination cursor: "{cursor}".') from exc
@@ -1,39 +1,143 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import random
 import sys
 import typing as t
-from sqlalchemy import Boolean, Column, delete, exists, func, update
-from sqlalchemy.engine import Result
+from sqlalchemy import Boolean, Column, and_, bindparam, delete, exists, func, inspect, or_, tuple_, update
+from sqlalchemy.engine import CursorResult, FrozenResult, Result, RowMapping
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.future import select
-from sqlalchemy.orm import InstrumentedAttribute, joinedload, load_only, selectinload
-from sqlalchemy.sql import Executable, Select
-from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.orm import InstrumentedAttribute, Session, joinedload, load_only, selectinload
+from sqlalchemy.orm.evaluator import EvaluatorCompiler, UnevaluatableError
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.orm.loading import merge_frozen_result
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql import ClauseElement, Executable, Select, operators
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, ColumnElement, literal_column
 from sqlalchemy.sql.sqltypes import NullType
+from sqlalchemy.sql.util import ClauseAdapter
 
 from aerie.base import Base
+from aerie.cache import CacheBackend, CacheOptions, make_cache_key, make_result_cache_entry
 from aerie.collections import Collection
-from aerie.paginator import Page
-from aerie.utils import colorize, convert_exceptions
+from aerie.exceptions import AerieError, InvalidCursorError
+from aerie.paginator import CursorPage, Page, decode_cursor, encode_cursor
+from aerie.utils import (
+    LARGE_IN_THRESHOLD,
+    AsyncStream,
+    colorize,
+    chunked,
+    convert_exceptions,
+    get_table_names,
+    in_conditions,
+    large_in,
+    supports_window_functions,
+    unwrap_order_by,
+)
+
+if t.TYPE_CHECKING:  # pragma: no cover
+    from aerie.session import DbSession
 
 M = t.TypeVar('M', bound=Base)
 E = t.TypeVar('E', bound=Base)
 
+_CountMode = t.Literal['exact', 'capped', 'estimate']
 
-class SelectQuery(t.Generic[M]):
+
+class BatchProgress(t.NamedTuple):
+    """Progress of batched `SelectQuery.update` and `SelectQuery.delete` operations."""
+
+    batches: int
+    """A number of processed batches."""
+    rows: int
+    """A number of affected rows so far."""
+    last_key: t.Any
+    """The primary key of the last processed row, pass it as `resume_after` to continue after interruption."""
+
+
+_BatchCallback = t.Callable[[BatchProgress], t.Any]
+
+
+class _Explain(Executable, ClauseElement):
+    """Return a query plan of the statement in JSON format (PostgreSQL only)."""
+
+    inherit_cache = False
+
+    def __init__(self, stmt: Select) -> None:
+        self.stmt = stmt
+
+
+@compiles(_Explain, 'postgresql')
+def _compile_explain(element: _Explain, compiler: SQLCompiler, **kwargs: t.Any) -> str:
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.stmt, **kwargs)
+
+
+def _detach_frozen_result(stmt: Select, frozen_result: FrozenResult) -> FrozenResult:
+    """Copy entities of the result into detached instances,
+    so changes made to entities by the current session do not leak into the cache."""
+    session = Session()
+    detached = merge_frozen_result(session, stmt, frozen_result, load=False)
+    session.expunge_all()
+    return detached
+
+
+class _ColumnAggregates:
+    """Shortcuts for aggregates of a single column, shared by `SelectQuery` and `ShardedQuery`."""
+
+    _model: t.Type[t.Any]
+
+    async def aggregate(self, **aggregates: ColumnElement) -> t.Any:  # pragma: no cover
+        raise NotImplementedError()
+
+    async def sum(self, column: t.Union[str, ColumnElement]) -> t.Any:
+        """Compute a sum of column values.
+        When the query is grouped, returns a mapping of group keys to values."""
+        return await self._aggregate_column(func.sum, column)
+
+    async def avg(self, column: t.Union[str, ColumnElement]) -> t.Any:
+        """Compute an average of column values.
+        When the query is grouped, returns a mapping of group keys to values."""
+        return await self._aggregate_column(func.avg, column)
+
+    async def min(self, column: t.Union[str, ColumnElement]) -> t.Any:
+        """Find the smallest column value.
+        When the query is grouped, returns a mapping of group keys to values."""
+        return await self._aggregate_column(func.min, column)
+
+    async def max(self, column: t.Union[str, ColumnElement]) -> t.Any:
+        """Find the biggest column value.
+        When the query is grouped, returns a mapping of group keys to values."""
+        return await self._aggregate_column(func.max, column)
+
+    async def _aggregate_column(self, fn: t.Callable[..., ColumnElement], column: t.Union[str, ColumnElement]) -> t.Any:
+        if isinstance(column, str):
+            column = getattr(self._model, column)
+        result = await self.aggregate(value=fn(column))
+        if isinstance(result, Collection):
+            return {row[0] if len(row) == 2 else tuple(row[:-1]): row[-1] for row in result}
+        return result['value']
+
+
+class SelectQuery(_ColumnAggregates, t.Generic[M]):
     def __init__(
         self,
         model: t.Type[M],
-        executor: AsyncSession,
+        executor: DbSession,
         base_stmt: Select = None,
+        cache_options: CacheOptions = None,
     ) -> None:
         self._model: t.Type[Base] = model
         self._executor = executor
         self._stmt: Select = select(model) if base_stmt is None else base_stmt
         self._is_session = isinstance(executor, AsyncSession)
+        self._cache_options = cache_options
 
     def where(self, *conditions: ColumnElement[Boolean]) -> SelectQuery[M]:
-        return self._clone(base_stmt=self._stmt.where(*conditions))
+        return self._clone(base_stmt=self._stmt.where(*[self._rewrite_large_in(condition) for condition in conditions]))
 
     def having(self, conditions: ColumnElement[Boolean]) -> SelectQuery[M]:
         return self._clone(base_stmt=self._stmt.having(conditions))
@@ -114,6 +218,15 @@ class SelectQuery(t.Generic[M]):
     #     self._stmt = self._stmt.union_all(*q)
     #     return self
 
+    def cache(self, ttl: float = None, key: str = None, tags: t.Iterable[str] = ()) -> SelectQuery[M]:
+        """Cache results of this query in the session cache.
+        Entries are invalidated when the tables the query reads from are modified.
+        The `key` groups entries of the query, they can be dropped with `cache.invalidate(key)`.
+        Cached entities are merged into the current session without a database roundtrip."""
+        query = self._clone(base_stmt=self._stmt)
+        query._cache_options = CacheOptions(ttl=ttl, key=key, tags=tuple(tags))
+        return query
+
     def only(self, *columns: t.Union[str, Column]) -> SelectQuery[M]:
         return self.options(load_only(*columns))
 
@@ -145,15 +258,35 @@ class SelectQuery(t.Generic[M]):
         result = await self._execute(self._stmt)
         return Collection(result.scalars().all())
 
+    def iterate(self, batch: int = 1000) -> AsyncStream[M]:
+        """Stream entities from the database in batches of `batch` rows.
+        Every processed batch is expunged from the session to keep memory usage bounded,
+        entities with pending changes are kept in the session until they are flushed.
+        To stop early, use the stream as an async context manager, it closes the cursor on exit."""
+        return AsyncStream(self._iterate(batch))
+
+    async def values(self, *columns: t.Union[str, ColumnElement]) -> Collection[RowMapping]:
+        """Select only given columns (or all model columns) and return rows as mappings.
+        Entities are not created, so this is much cheaper than loading models."""
+        result = await self._execute(self._projection(columns))
+        return Collection(t.cast(t.List[RowMapping], result.mappings().all()))
+
+    async def values_list(self, *columns: t.Union[str, ColumnElement]) -> Collection[t.Tuple[t.Any, ...]]:
+        """Select only given columns (or all model columns) and return rows as plain tuples."""
+        result = await self._execute(self._projection(columns))
+        return Collection([tuple(row) for row in result])
+
+    tuples = values_list
+
     async def choices(self, label_column: str = 'name', value_column: str = 'id') -> t.List[t.Tuple[str, t.Any]]:
-        result = await self._execute(self._stmt)
-        return Collection(result.scalars().all()).choices(label_col=label_column, value_col=value_column)
+        rows = await self.values(value_column, label_column)
+        return rows.choices(label_col=label_column, value_col=value_column)
 
     async def choices_dict(
         self, label_column: str = 'name', value_column: str = 'id', label_key: str = 'label', value_key: str = 'value'
     ) -> list[t.Dict[t.Any, t.Any]]:
-        result = await self._execute(self._stmt)
-        return Collection(result.scalars().all()).choices_dict(
+        rows = await self.values(value_column, label_column)
+        return rows.choices_dict(
             label_col=label_column,
             value_col=value_column,
             label_key=label_key,
@@ -166,36 +299,434 @@ class SelectQuery(t.Generic[M]):
         return result.scalar() is True
 
     async def count(self) -> int:
-        stmt = select(func.count('*')).select_from(self._stmt)
-        result = await self._execute(stmt)
+        result = await self._execute(self._count_stmt())
         count = result.scalar()
         return int(count) if count else 0
 
-    async def paginate(self, page: int = 1, page_size: int = 50) -> Page:
-        offset = (page - 1) * page_size
-        total = await self.count()
-        rows = await self.limit(page_size).offset(offset).all()
+    async def aggregate(self, **aggregates: ColumnElement) -> t.Any:
+        """Compute aggregate expressions in the database, for example:
+        `await query.aggregate(total=func.sum(Order.price), orders=func.count())`.
+
+        Returns a mapping of aggregate names to values.
+        When the query is grouped, returns a collection of rows with grouping columns and aggregates."""
+        group_by = list(self._stmt._group_by_clauses)  # type: ignore[attr-defined]
+        columns = [expression.label(name) for name, expression in aggregates.items()]
+        stmt: t.Any = self._stmt
+        if not group_by and (stmt._limit_clause is not None or stmt._offset_clause is not None or stmt._distinct):
+            # LIMIT, OFFSET and DISTINCT must apply to aggregated rows, not to the row of aggregates
+            subquery = stmt.subquery()
+            adapter = ClauseAdapter(subquery)
+            stmt = select(*[adapter.traverse(column) for column in columns]).select_from(subquery)
+        else:
+            stmt = stmt.with_only_columns(*group_by, *columns).select_from(self._model)
+        if not group_by:
+            stmt = stmt.order_by(None)
+
+        result = await self._execute(stmt)
+        if group_by:
+            return Collection(result.all())
+        return dict(result.one()._mapping)
+
+    async def paginate(
+        self,
+        page: int = 1,
+        page_size: int = 50,
+        single_query: bool = False,
+        count: _CountMode = 'exact',
+        count_limit: int = 10_000,
+        cache_count: bool = False,
+    ) -> Page:
+        """Paginate the query by offset.
+        When `single_query` is set, the total row count is fetched along with the rows using `count(*) OVER ()`.
+        If the database cannot do that, count and row queries are executed concurrently when possible.
+
+        Counting all rows of huge tables is expensive, use `count` to choose how the total is computed:
+        "exact" counts all rows, "capped" stops counting after `count_limit` rows
+        and "estimate" uses planner statistics (PostgreSQL) or sampling (SQLite)
+        when there are more than `count_limit` rows.
+
+        When `cache_count` is set, the exact total is stored in the session cache
+        and reused by subsequent calls until the underlying tables are modified."""
+        if count != 'exact':
+            return await self._paginate_inexact(page, page_size, count, count_limit)
+
+        tables = get_table_names(self._stmt)
+        if not cache_count or self._cache_backend is None or self._executor.has_pending_writes(tables):
+            return await self._paginate_exact(page, page_size, single_query)
+
+        cache_key = self._count_cache_key()
+        total = await self._cache_backend.get(cache_key)
+        if total is None:
+            result = await self._paginate_exact(page, page_size, single_query)
+            await self._cache_backend.set(cache_key, result.total_rows, tags=tables)
+            return result
+
+        rows = await self.limit(page_size).offset((page - 1) * page_size).all()
         return Page(list(rows), total, page, page_size)
 
-    async def update(self, **values: t.Any) -> None:
-        stmt = update(self._model).where(self._stmt.whereclause).values(**values)
-        await self._execute(stmt)
+    async def paginate_after(self, cursor: str = None, page_size: int = 50) -> CursorPage[M]:
+        """Paginate using keyset (seek) method.
+        Rows are located by the values of ORDER BY columns instead of offset,
+        so the query cost does not depend on the page depth.
+        Primary key columns are appended to the sort key to make it unique."""
+        keyset = self._get_keyset()
+        values, backwards = decode_cursor(cursor) if cursor else ([], False)
+        if cursor and len(values) != len(keyset):
+            raise InvalidCursorError(f'Cursor does not match the sort key of this query: "{cursor}".')
+        if None in values:
+            raise InvalidCursorError(f'Cursor contains NULL values, they cannot be compared: "{cursor}".')
+
+        stmt = self._stmt.order_by(None).order_by(
+            *[column.desc() if descending != backwards else column.asc() for column, descending, _ in keyset]
+        )
+        if values:
+            stmt = stmt.where(self._keyset_condition(keyset, values, backwards))
+
+        result = await self._execute(stmt.limit(page_size + 1))
+        rows = list(result.scalars().all())
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        has_next = bool(cursor) if backwards else has_more
+        has_previous = has_more if backwards else bool(cursor)
+        return CursorPage(
+            rows,
+            page_size,
+            next_cursor=self._make_cursor(keyset, rows[-1]) if rows and has_next else None,
+            previous_cursor=self._make_cursor(keyset, rows[0], backwards=True) if rows and has_previous else None,
+        )
 
-    async def delete(self) -> None:
-        stmt = delete(self._model).where(self._stmt.whereclause)
-        await self._execute(stmt)
+    async def update(
+        self,
+        values: t.Mapping[str, t.Any] = None,
+        /,
+        *,
+        batch_size: int = None,
+        pause: float = 0,
+        resume_after: t.Any = None,
+        on_batch: _BatchCallback = None,
+        **kwargs: t.Any,
+    ) -> int:
+        """Update matching rows with `values` and keyword arguments, return a number of updated rows.
+        Pass columns named like options of this method, for example `pause`, in the `values` mapping.
+        When `batch_size` is set, rows are updated in batches, see `delete` for details."""
+        values = {**(values or {}), **kwargs}
+        if batch_size is None:
+            stmt = update(self._model).where(self._stmt.whereclause).values(**values)
+            result = await self._execute(stmt.execution_options(synchronize_session=self._synchronize_session()))
+            await self._invalidate_cache()
+            return t.cast(CursorResult, result).rowcount
+
+        return await self._execute_in_batches(
+            lambda condition: update(self._model).where(condition).values(**values),
+            batch_size,
+            pause,
+            resume_after,
+            on_batch,
+        )
+
+    async def delete(
+        self,
+        *,
+        batch_size: int = None,
+        pause: float = 0,
+        resume_after: t.Any = None,
+        on_batch: _BatchCallback = None,
+    ) -> int:
+        """Delete matching rows and return a number of deleted rows.
+
+        When `batch_size` is set, primary keys of matching rows are walked in ascending order
+        and every `batch_size` rows are deleted and committed separately, waiting `pause` seconds between batches.
+        This keeps locks short on large tables. After each batch, `on_batch` callback receives `BatchProgress`.
+        To resume an interrupted run, pass the `last_key` of the last reported batch as `resume_after`.
+
+        Each batch commits the session, so the session must not have uncommitted changes when batches start.
+        Otherwise, `AerieError` is raised."""
+        if batch_size is None:
+            stmt = delete(self._model).where(self._stmt.whereclause)
+            result = await self._execute(stmt.execution_options(synchronize_session=self._synchronize_session()))
+            await self._invalidate_cache()
+            return t.cast(CursorResult, result).rowcount
+
+        return await self._execute_in_batches(
+            lambda condition: delete(self._model).where(condition),
+            batch_size,
+            pause,
+            resume_after,
+            on_batch,
+        )
 
     async def execute(self) -> Result:
         return await self._execute(self._stmt)
 
+    async def _iterate(self, batch: int) -> t.AsyncGenerator[M, None]:
+        result = await self._executor.stream(self._stmt.execution_options(yield_per=batch))
+        try:
+            async for partition in result.scalars().partitions(batch):  # type: ignore[attr-defined]
+                for entity in partition:
+                    yield entity
+                if self._is_session:
+                    for entity in partition:
+                        if not self._executor.is_modified(entity) and entity not in self._executor.deleted:
+                            self._executor.expunge(entity)
+        finally:
+            await result.close()
+
     async def _execute(self, stmt: Executable, params: t.Mapping = None) -> Result:
-        return await self._executor.execute(stmt, params)
+        if self._cache_options is None or self._cache_backend is None or not isinstance(stmt, Select):
+            return await self._executor.execute(stmt, params)
+
+        tables = get_table_names(stmt)
+        if self._executor.has_pending_writes(tables):
+            return await self._executor.execute(stmt, params)
+
+        options = self._cache_options
+        cache_key, tags = make_result_cache_entry(options, stmt, params, self._executor.bind.dialect)
+        frozen_result = await self._cache_backend.get(cache_key)
+        if frozen_result is not None:
+            return merge_frozen_result(self._executor.sync_session, stmt, frozen_result, load=False)()
+
+        frozen_result = (await self._executor.execute(stmt, params)).freeze()
+        await self._cache_backend.set(cache_key, _detach_frozen_result(stmt, frozen_result), options.ttl, tags)
+        return frozen_result()
+
+    async def _execute_in_batches(
+        self,
+        make_stmt: t.Callable[[ColumnElement[Boolean]], Executable],
+        batch_size: int,
+        pause: float,
+        resume_after: t.Any,
+        on_batch: t.Optional[_BatchCallback],
+    ) -> int:
+        self._ensure_no_pending_changes()
+        mapper = inspect(self._model)
+        pk_columns = [getattr(self._model, mapper.get_property_by_column(column).key) for column in mapper.primary_key]
+        keyset = pk_columns[0] if len(pk_columns) == 1 else tuple_(*pk_columns)
+        progress = BatchProgress(batches=0, rows=0, last_key=resume_after)
+        while True:
+            stmt = self._stmt.with_only_columns(*pk_columns).order_by(None).order_by(*pk_columns).limit(batch_size)
+            if progress.last_key is not None:
+                stmt = stmt.where(keyset > progress.last_key)
+            keys = [key[0] if len(pk_columns) == 1 else tuple(key) for key in await self._executor.execute(stmt)]
+            if not keys:
+                return progress.rows
+
+            # matching conditions are applied once again as rows could change after keys were selected
+            condition = self._keys_condition(pk_columns, keys)
+            if self._stmt.whereclause is not None:
+                condition = and_(condition, self._stmt.whereclause)
+            dml_stmt = make_stmt(condition).execution_options(synchronize_session=self._synchronize_session(condition))
+            result = await self._executor.execute(dml_stmt)
+            await self._invalidate_cache()
+            if self._is_session:
+                await self._executor.commit()
+
+            progress = BatchProgress(
+                batches=progress.batches + 1,
+                rows=progress.rows + t.cast(CursorResult, result).rowcount,
+                last_key=keys[-1],
+            )
+            if on_batch is not None:
+                callback_result = on_batch(progress)
+                if asyncio.iscoroutine(callback_result):
+                    await callback_result
+
+            if len(keys) < batch_size:
+                return progress.rows
+            if pause:
+                await asyncio.sleep(pause)
+
+    def _ensure_no_pending_changes(self) -> None:
+        # committing a batch would also commit unrelated changes of the caller
+        session = self._executor
+        if self._is_session and (session.new or session.dirty or session.deleted or session.written_tables):
+            raise AerieError('Batches commit the session, commit or roll back pending changes first.')
+
+    def _keys_condition(self, pk_columns: t.List[InstrumentedAttribute], keys: t.List[t.Any]) -> ColumnElement[Boolean]:
+        """Match rows by primary keys without binding a parameter per key, see `in_conditions`."""
+        if len(pk_columns) == 1:
+            return or_(*in_conditions(pk_columns[0], keys, self._executor.bind.dialect))
+        return or_(*[tuple_(*pk_columns).in_(chunk) for chunk in chunked(keys, LARGE_IN_THRESHOLD)])
+
+    def _synchronize_session(self, condition: ColumnElement[Boolean] = None) -> str:
+        """Choose how UPDATE and DELETE statements synchronize entities of the session.
+        The condition (the query WHERE clause by default) is evaluated in Python when possible,
+        otherwise, for example for `column = ANY(:values)` built by `large_in`, affected rows are fetched."""
+        condition = self._stmt.whereclause if condition is None else condition
+        if condition is None:
+            return 'evaluate'
+        try:
+            EvaluatorCompiler(self._model).process(condition)
+        except UnevaluatableError:
+            return 'fetch'
+        return 'evaluate'
+
+    def _projection(self, columns: t.Sequence[t.Union[str, ColumnElement]]) -> Select:
+        if not columns:
+            columns = list(inspect(self._model).columns)
+        columns = [getattr(self._model, column) if isinstance(column, str) else column for column in columns]
+        return self._stmt.with_only_columns(*columns).select_from(self._model)
+
+    @property
+    def _cache_backend(self) -> t.Optional[CacheBackend]:
+        return getattr(self._executor, 'cache', None)
+
+    async def _invalidate_cache(self) -> None:
+        if self._cache_backend is not None:
+            await self._executor.invalidate_cache(*[table.fullname for table in inspect(self._model).tables])
+
+    def _count_stmt(self) -> Select:
+        return select(func.count('*')).select_from(self._stmt.subquery())
+
+    def _count_cache_key(self) -> str:
+        return make_cache_key('aerie:count', self._count_stmt(), dialect=self._executor.bind.dialect)
+
+    async def _paginate_exact(self, page: int, page_size: int, single_query: bool) -> Page:
+        if single_query:
+            distinct = self._stmt._distinct  # type: ignore[attr-defined]
+            if supports_window_functions(self._executor.bind.dialect) and not distinct:
+                return await self._paginate_with_window(page, page_size)
+            if self._can_count_concurrently():
+                return await self._paginate_concurrently(page, page_size)
+
+        offset = (page - 1) * page_size
+        total = await self.count()
+        rows = await self.limit(page_size).offset(offset).all()
+        return Page(list(rows), total, page, page_size)
+
+    async def _paginate_with_window(self, page: int, page_size: int) -> Page:
+        offset = (page - 1) * page_size
+        stmt = self._stmt.add_columns(func.count().over().label('__total__')).limit(page_size).offset(offset)
+        result = await self._execute(stmt)
+        records = result.all()
+        if records:
+            total = records[0][-1]
+        else:
+            total = await self.count() if page > 1 else 0  # the page is out of range, no rows to read total from
+        return Page([record[0] for record in records], total, page, page_size)
+
+    async def _paginate_inexact(self, page: int, page_size: int, count: _CountMode, count_limit: int) -> Page:
+        total, is_exact = await self._count_capped(count_limit)
+        if not is_exact and count == 'estimate':
+            total = max(total, await self._count_estimate(count_limit))
+
+        offset = (page - 1) * page_size
+        rows = list(await self.limit(page_size + 1).offset(offset).all())
+        return Page(rows[:page_size], total, page, page_size, total_is_exact=is_exact, has_more=len(rows) > page_size)
+
+    async def _count_capped(self, limit: int) -> t.Tuple[int, bool]:
+        """Count at most `limit` rows. Returns the count and the flag whether it is exact."""
+        stmt = select(func.count('*')).select_from(self._stmt.limit(limit + 1).subquery())
+        result = await self._execute(stmt)
+        count = int(result.scalar() or 0)
+        return min(count, limit), count <= limit
+
+    async def _count_estimate(self, sample_size: int) -> int:
+        dialect = self._executor.bind.dialect
+        if dialect.name == 'postgresql':
+            result = await self._execute(_Explain(self._stmt))
+            plan: t.Any = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        if dialect.name == 'sqlite':
+            # count matches among `sample_size` random rowids and extrapolate it onto the whole rowid range
+            table = inspect(self._model).local_table
+            rowid = literal_column(f'{dialect.identifier_preparer.format_table(table)}.rowid')
+            result = await self._execute(select(func.max(rowid)).select_from(table))
+            max_rowid = int(result.scalar() or 0)
+            sample = random.sample(range(1, max_rowid + 1), min(sample_size, max_rowid))
+            if not sample:
+                return 0
+            condition = rowid.in_(bindparam(None, sample, expanding=True, literal_execute=True))
+            result = await self._execute(select(func.count('*')).select_from(self._stmt.where(condition).subquery()))
+            matched = int(result.scalar() or 0)
+            return int(matched * max_rowid / len(sample))
+
+        return await self.count()
+
+    def _can_count_concurrently(self) -> bool:
+        """The count query can run on a separate connection
+        only if the session has no transaction whose uncommitted changes it must see."""
+        if self._is_session and self._executor.in_transaction():
+            return False
+        return not isinstance(self._executor.bind.pool, StaticPool)
+
+    async def _paginate_concurrently(self, page: int, page_size: int) -> Page:
+        async def count() -> int:
+            async with self._executor.bind.connect() as connection:
+                result = await connection.execute(self._count_stmt())
+                return int(result.scalar() or 0)
+
+        offset = (page - 1) * page_size
+        total, rows = await asyncio.gather(count(), self.limit(page_size).offset(offset).all())
+        return Page(list(rows), total, page, page_size)
 
-    def _clone(self, *, base_stmt: Select) -> SelectQuery:
+    def _get_keyset(self) -> t.List[t.Tuple[ColumnElement, bool, str]]:
+        """Return a list of (column, is descending, attribute name) tuples that make up the sort key."""
+        mapper = inspect(self._model)
+        keyset = []
+        for clause in self._stmt._order_by_clauses:  # type: ignore[attr-defined]
+            clause, descending, _ = unwrap_order_by(clause)
+            try:
+                keyset.append((clause, descending, mapper.get_property_by_column(clause).key))
+            except UnmappedColumnError as exc:
+                raise ValueError(f'Cannot use "{clause}" as a keyset pagination column.') from exc
+
+        used_keys = [key for _, _, key in keyset]
+        for column in mapper.primary_key:
+            key = mapper.get_property_by_column(column).key
+            if key not in used_keys:
+                keyset.append((getattr(self._model, key), False, key))
+        return keyset
+
+    def _keyset_condition(
+        self, keyset: t.List[t.Tuple[ColumnElement, bool, str]], values: t.List[t.Any], backwards: bool
+    ) -> ColumnElement[Boolean]:
+        directions = {descending != backwards for _, descending, _ in keyset}
+        if len(directions) == 1:  # a row value comparison can use a composite index
+            columns: ColumnElement = tuple_(*[column for column, _, _ in keyset])
+            return columns < tuple_(*values) if directions.pop() else columns > tuple_(*values)
+
+        conditions = []
+        for index, (column, descending, _) in enumerate(keyset):
+            seek = column < values[index] if descending != backwards else column > values[index]
+            equals = [keyset[prev][0] == values[prev] for prev in range(index)]
+            conditions.append(and_(*equals, seek))
+        return or_(*conditions)
+
+    def _make_cursor(self, keyset: t.List[t.Tuple[ColumnElement, bool, str]], row: M, backwards: bool = False) -> str:
+        values = [getattr(row, key) for _, _, key in keyset]
+        for (column, _, _), value in zip(keyset, values):
+            # comparisons with NULL are never true, rows after this one would be silently skipped
+            if value is None:
+                raise ValueError(f'Cannot use "{column}" as a keyset pagination column, it contains NULL values.')
+        return encode_cursor(values, backwards)
+
+    def _rewrite_large_in(self, condition: ColumnElement[Boolean]) -> ColumnElement[Boolean]:
+        """Replace `column.in_(values)` condition having a long list of values with `large_in` one."""
+        if (
+            isinstance(condition, BinaryExpression)
+            and condition.operator is operators.in_op
+            and isinstance(condition.right, BindParameter)
+            and condition.right.expanding
+            and isinstance(condition.right.value, (list, tuple))
+            and len(condition.right.value) > LARGE_IN_THRESHOLD
+        ):
+            rewritten = large_in(condition.left, condition.right.value, self._executor.bind.dialect)
+            if rewritten is not None:
+                return rewritten
+        return condition
+
+    def _clone(self, *, base_stmt: Select = None, executor: DbSession = None) -> SelectQuery:
         return SelectQuery(
             model=self._model,
-            executor=self._executor,
-            base_stmt=base_stmt,
+            executor=self._executor if executor is None else executor,
+            base_stmt=self._stmt if base_stmt is None else base_stmt,
+            cache_options=self._cache_options,
         )
 
     def __await__(self) -> t.Generator[t.Any, None, Collection[M]]:
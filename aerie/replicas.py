@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import contextvars as cv
+import random
+import re
+import time
+import typing as t
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine, ExceptionContext
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ClauseElement, Executable, Select
+from sqlalchemy.sql.elements import TextClause
+
+
+class _Replica:
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        self.latency = 0.0
+        """Average statement execution time in seconds."""
+        self.failures = 0
+        self.down_until = 0.0
+
+    @property
+    def weight(self) -> float:
+        return 1 / (self.latency + 0.001)
+
+
+class ReplicaRouter:
+    """Routes reads to read replicas and writes to the primary database.
+
+    Replicas are chosen randomly, faster replicas receive proportionally more reads.
+    A replica that failed with a connection error is skipped for `retry_after` seconds,
+    doubled on each consecutive failure up to `max_retry_after` seconds. After a write, reads of the same context
+    (asyncio task and tasks it spawns) go to the primary for `sticky_window` seconds."""
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: t.Iterable[AsyncEngine],
+        sticky_window: float = 5,
+        retry_after: float = 5,
+        max_retry_after: float = 300,
+    ) -> None:
+        self.primary = primary
+        self.replicas = [_Replica(engine) for engine in replicas]
+        self.sticky_window = sticky_window
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self._last_write_at: cv.ContextVar[float] = cv.ContextVar(f'aerie_last_write_{id(self)}', default=0.0)
+        self._use_primary: cv.ContextVar[bool] = cv.ContextVar(f'aerie_use_primary_{id(self)}', default=False)
+        for replica in self.replicas:
+            self._track_health(replica)
+
+    def get_engine(self, stmt: t.Optional[t.Union[ClauseElement, Executable]]) -> AsyncEngine:
+        """Return an engine to execute the statement with."""
+        if not is_read_statement(stmt):
+            self.mark_write()
+            return self.primary
+        return self.choose_replica() or self.primary
+
+    def choose_replica(self) -> t.Optional[AsyncEngine]:
+        """Return a healthy replica engine or None, if reads have to go to the primary."""
+        if self._use_primary.get() or time.monotonic() - self._last_write_at.get() < self.sticky_window:
+            return None
+
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica.down_until <= now]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[replica.weight for replica in candidates])[0].engine
+
+    def mark_write(self) -> None:
+        self._last_write_at.set(time.monotonic())
+
+    def mark_failed(self, engine: AsyncEngine) -> None:
+        for replica in self.replicas:
+            if replica.engine is engine:
+                backoff = min(self.retry_after * 2 ** min(replica.failures, 32), self.max_retry_after)
+                replica.down_until = time.monotonic() + backoff
+                replica.failures += 1
+
+    @contextmanager
+    def use_primary(self) -> t.Generator[None, None, None]:
+        token = self._use_primary.set(True)
+        try:
+            yield
+        finally:
+            self._use_primary.reset(token)
+
+    def _track_health(self, replica: _Replica) -> None:
+        sync_engine = replica.engine.sync_engine
+
+        @event.listens_for(sync_engine, 'before_cursor_execute')
+        def before_execute(connection: Connection, *args: t.Any) -> None:
+            connection.info['aerie_started_at'] = time.perf_counter()
+
+        @event.listens_for(sync_engine, 'after_cursor_execute')
+        def after_execute(connection: Connection, *args: t.Any) -> None:
+            elapsed = time.perf_counter() - connection.info.pop('aerie_started_at', time.perf_counter())
+            replica.latency = replica.latency * 0.8 + elapsed * 0.2
+            replica.failures = 0
+
+        @event.listens_for(sync_engine, 'handle_error')
+        def handle_error(context: ExceptionContext) -> None:
+            if context.is_disconnect or context.connection is None:
+                self.mark_failed(replica.engine)
+
+
+class RoutingSession(Session):
+    """Session that loads entities from replicas until it writes anything.
+    After the first write, all statements of the session go to the primary."""
+
+    def __init__(self, *args: t.Any, router: ReplicaRouter = None, **kwargs: t.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self.wrote = False
+
+    def get_bind(
+        self,
+        mapper: t.Any = None,
+        clause: ClauseElement = None,
+        bind: t.Union[Connection, Engine] = None,
+        _sa_skip_events: t.Any = None,
+        _sa_skip_for_implicit_returning: bool = False,
+    ) -> t.Union[Connection, Engine]:
+        primary = super().get_bind(
+            mapper,
+            clause=clause,
+            bind=bind,
+            _sa_skip_events=_sa_skip_events,
+            _sa_skip_for_implicit_returning=_sa_skip_for_implicit_returning,
+        )
+        if self.router is None or self.wrote:
+            return primary
+
+        flushing: bool = self._flushing  # type: ignore[attr-defined]
+        if flushing or (clause is not None and not is_read_statement(clause)):
+            self.wrote = True
+            self.router.mark_write()
+            return primary
+
+        replica = self.router.choose_replica() if clause is not None else None
+        return primary if replica is None else replica.sync_engine
+
+
+_PRIMARY_ONLY_SQL = re.compile(
+    r'\bfor\s+(no\s+key\s+update|update|key\s+share|share)\b'  # locking reads
+    r'|\b(nextval|setval|currval|lastval)\s*\(',  # sequence functions
+    re.IGNORECASE,
+)
+
+
+def is_read_statement(stmt: t.Optional[t.Union[ClauseElement, Executable]]) -> bool:
+    """Test if the statement only reads data and can be executed by a replica.
+    Raw SELECT statements with locking clauses or sequence functions go to the primary,
+    raw reads calling other functions with side effects have to be wrapped with `use_primary()`."""
+    if isinstance(stmt, Select):
+        return stmt._for_update_arg is None  # type: ignore[attr-defined]
+    if isinstance(stmt, TextClause):
+        sql = stmt.text.lstrip()
+        return sql.lower().startswith('select') and not _PRIMARY_ONLY_SQL.search(sql)
+    return False
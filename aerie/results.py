@@ -1,18 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import json
 import typing as t
+from contextlib import asynccontextmanager
 from sqlalchemy import text
 from sqlalchemy.engine import Result, Row
-from sqlalchemy.ext.asyncio import AsyncEngine
-from sqlalchemy.sql import Executable
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncResult
+from sqlalchemy.sql import ClauseElement, Executable
+from sqlalchemy.sql.compiler import SQLCompiler
 
+from aerie.cache import CacheBackend, CacheOptions, make_result_cache_entry
 from aerie.collections import Collection
-from aerie.utils import convert_exceptions
+from aerie.utils import AsyncStream, convert_exceptions, get_table_names
+
+
+class _AsyncWriter(t.Protocol):
+    async def write(self, data: str) -> t.Any:
+        ...  # pragma: no cover
+
+
+_Writer = t.Union[t.IO[str], _AsyncWriter]
+
+
+async def _write(writer: _Writer, data: str) -> None:
+    result = writer.write(data)
+    if asyncio.iscoroutine(result):
+        await result
+
+
+def _format_csv(rows: t.Iterable[t.Sequence[t.Any]]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
 
 
 class ResultProxy:
-    def __init__(self, engine: AsyncEngine, stmt: t.Union[str, Executable], params: t.Mapping = None) -> None:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        stmt: t.Union[str, Executable],
+        params: t.Mapping = None,
+        cache: CacheBackend = None,
+        connection: AsyncConnection = None,
+        fallback_engine: AsyncEngine = None,
+        written_tables: t.Set[str] = None,
+    ) -> None:
         self._engine = engine
+        self._connection = connection
+        self._written_tables = written_tables
+        """Tables modified in the transaction of the shared connection, invalidated when it commits."""
+        self._fallback_engine = fallback_engine
         self._stmt = text(stmt) if isinstance(stmt, str) else stmt
         self._params = params
+        self._cache_backend = cache
+        self._cache_options: t.Optional[CacheOptions] = None
+
+    def _clone(self, connection: AsyncConnection = None) -> ResultProxy:
+        proxy = ResultProxy(
+            self._engine,
+            self._stmt,
+            self._params,
+            cache=self._cache_backend,
+            connection=connection,
+            fallback_engine=self._fallback_engine,
+        )
+        proxy._cache_options = self._cache_options
+        return proxy
+
+    def cache(self, ttl: float = None, key: str = None, tags: t.Iterable[str] = ()) -> ResultProxy:
+        """Cache the result of this statement.
+        Entries are invalidated when the tables the statement reads from are modified,
+        raw SQL statements have to be tagged explicitly."""
+        self._cache_options = CacheOptions(ttl=ttl, key=key, tags=tuple(tags))
+        return self
 
     async def all(self) -> Collection[Row]:
         result = await self._execute()
@@ -50,13 +114,138 @@ class ResultProxy:
         result = await self._execute()
         return result.unique(strategy)
 
-    async def partitions(self, size: int = None) -> t.Iterator[t.List[t.Any]]:
-        result = await self._execute()
-        return result.partitions(size)
+    def partitions(self, size: int = None) -> AsyncStream[t.List[Row]]:
+        """Stream rows in chunks of `size` using a server-side cursor.
+        Only one chunk is held in memory at a time.
+        The connection is held until all rows are read, see `stream` for stopping early."""
+        return AsyncStream(self._stream(size))
+
+    def stream(self, batch_size: int = None) -> AsyncStream[Row]:
+        """Iterate over rows using a server-side cursor.
+        Rows are fetched from the database in batches of `batch_size`.
+
+        The connection is held until all rows are read. To stop early, use the stream as an async context manager,
+        it releases the connection on exit: `async with proxy.stream() as rows: ...`."""
+        return AsyncStream(self._stream_rows(batch_size))
+
+    async def to_csv(self, writer: _Writer, header: bool = True, batch_size: int = 1000) -> int:
+        """Write rows to `writer` in CSV format and return a number of written rows.
+        The writer is either a text file-like object or an object with asynchronous `write` method.
+
+        On asyncpg, the database formats rows itself using `COPY (...) TO STDOUT` command,
+        other drivers stream rows using a server-side cursor and write them every `batch_size` rows.
+        Note that formats of some values (like booleans and dates) differ between these two modes."""
+        if self._engine.dialect.driver == 'asyncpg':
+            compiled = t.cast(ClauseElement, self._stmt).compile(dialect=self._engine.dialect)
+            if not compiled.post_compile_params:  # expanding IN parameters are rendered by SQLAlchemy at execution
+                return await self._copy_to_csv(t.cast(SQLCompiler, compiled), writer, header)
+
+        count = 0
+        async with self._open_stream(batch_size) as result:
+            if header:
+                await _write(writer, _format_csv([list(result.keys())]))
+            async for partition in result.partitions(batch_size):  # type: ignore[attr-defined]
+                await _write(writer, _format_csv(partition))
+                count += len(partition)
+        return count
+
+    async def to_ndjson(self, writer: _Writer, batch_size: int = 1000) -> int:
+        """Write rows to `writer` as newline delimited JSON objects and return a number of written rows.
+        Rows are streamed using a server-side cursor and written every `batch_size` rows.
+        Values which are not serializable to JSON (like dates) are converted to strings."""
+        count = 0
+        async with self._open_stream(batch_size) as result:
+            async for partition in result.partitions(batch_size):  # type: ignore[attr-defined]
+                await _write(writer, ''.join(json.dumps(dict(row._mapping), default=str) + '\n' for row in partition))
+                count += len(partition)
+        return count
 
     async def _execute(self) -> Result:
-        async with self._engine.begin() as connection:
+        if self._cache_backend is None:
+            return await self._execute_statement()
+
+        if getattr(self._stmt, 'is_dml', False):
+            result = await self._execute_statement()
+            if self._written_tables is None:
+                await self._cache_backend.invalidate(*get_table_names(self._stmt))
+            else:
+                self._written_tables.update(get_table_names(self._stmt))
+            return result
+
+        if self._cache_options is None:
+            return await self._execute_statement()
+
+        options = self._cache_options
+        cache_key, tags = make_result_cache_entry(options, self._stmt, self._params, self._engine.dialect)
+        if self._written_tables and not self._written_tables.isdisjoint(tags):
+            return await self._execute_statement()  # cached rows do not include uncommitted changes
+        frozen_result = await self._cache_backend.get(cache_key)
+        if frozen_result is None:
+            frozen_result = (await self._execute_statement()).freeze()
+            await self._cache_backend.set(cache_key, frozen_result, options.ttl, tags)
+        return frozen_result()
+
+    async def _execute_statement(self) -> Result:
+        try:
+            async with self._connect() as connection:
+                return await connection.execute(self._stmt, self._params)
+        except (OperationalError, InterfaceError):
+            if self._fallback_engine is None:
+                raise
+
+        # the replica is not available, retry on the primary
+        async with self._fallback_engine.begin() as connection:
             return await connection.execute(self._stmt, self._params)
 
+    @asynccontextmanager
+    async def _connect(self) -> t.AsyncGenerator[AsyncConnection, None]:
+        """Provide a connection in a transaction.
+        A shared connection is reused, its transaction (if any) is managed by the owner of the connection."""
+        if self._connection is None:
+            async with self._engine.begin() as connection:
+                yield connection
+        elif self._connection.in_transaction():
+            yield self._connection
+        else:
+            async with self._connection.begin():
+                yield self._connection
+
+    async def _stream(self, batch_size: int = None) -> t.AsyncGenerator[t.List[Row], None]:
+        async with self._open_stream(batch_size) as result:
+            async for partition in result.partitions(batch_size):  # type: ignore[attr-defined]
+                yield partition
+
+    async def _stream_rows(self, batch_size: int = None) -> t.AsyncGenerator[Row, None]:
+        async with self._open_stream(batch_size) as result:
+            async for partition in result.partitions(batch_size):  # type: ignore[attr-defined]
+                for row in partition:
+                    yield row
+
+    @asynccontextmanager
+    async def _open_stream(self, batch_size: int = None) -> t.AsyncGenerator[AsyncResult, None]:
+        execution_options = {'max_row_buffer': batch_size} if batch_size else {}
+        async with self._connect() as connection:
+            yield await connection.stream(self._stmt, self._params, execution_options=execution_options)
+
+    async def _copy_to_csv(self, compiled: SQLCompiler, writer: _Writer, header: bool) -> int:
+        """Export rows using `COPY (...) TO STDOUT` command of asyncpg."""
+        params = compiled.construct_params(self._params) or {}
+        # asyncpg dialect compiles to "format" paramstyle, asyncpg expects numbered placeholders
+        sql = compiled.string % tuple(f'${index}' for index in range(1, len(compiled.positiontup) + 1))
+        args = [params[name] for name in compiled.positiontup]
+
+        async def output(data: bytes) -> None:
+            await _write(writer, data.decode())
+
+        async with self._engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            status = await raw_connection.driver_connection.copy_from_query(
+                sql, *args, output=output, format='csv', header=header
+            )
+        return int(status.split()[-1])
+
+    def __aiter__(self) -> AsyncStream[Row]:
+        return self.stream()
+
     def __await__(self) -> t.Generator[Result, None, Result]:
         return self._execute().__await__()
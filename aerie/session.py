@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import contextvars as cv
+import itertools
 import typing as t
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session
 
 from aerie.base import Base
+from aerie.cache import CacheBackend
 from aerie.exceptions import NoActiveSessionError
+from aerie.loader import BatchLoader
 from aerie.queries import SelectQuery
+from aerie.utils import get_table_names
 
 M = t.TypeVar('M', bound=Base)
 
@@ -15,6 +21,16 @@ class DbSession(AsyncSession):
     current_session_stack: cv.ContextVar[list[DbSession]] = cv.ContextVar('current_session_stack', default=[])
     """A list of DbSession instances associated with current task."""
 
+    def __init__(self, *args: t.Any, cache: CacheBackend = None, **kwargs: t.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.written_tables: t.Set[str] = set()
+        """Names of tables modified by this session and not committed yet."""
+        self.loaders: t.Dict[t.Tuple[type, str], BatchLoader] = {}
+        """Batch loaders of models keyed by model class and key column name."""
+        event.listen(self.sync_session, 'after_flush', self._collect_written_tables)
+        event.listen(self.sync_session, 'do_orm_execute', self._collect_executed_tables)
+
     def query(self, model: t.Type[M]) -> SelectQuery[M]:
         return SelectQuery(model, self)
 
@@ -27,6 +43,44 @@ class DbSession(AsyncSession):
         except IndexError:
             raise NoActiveSessionError()
 
+    def has_pending_writes(self, tables: t.Iterable[str]) -> bool:
+        """Test if any of `tables` has changes in this session that are not committed yet."""
+        pending_tables = set(self.written_tables)
+        for instance in itertools.chain(self.new, self.dirty, self.deleted):
+            pending_tables.update(table.fullname for table in inspect(instance).mapper.tables)
+        return not pending_tables.isdisjoint(tables)
+
+    async def invalidate_cache(self, *tables: str) -> None:
+        """Drop cached data that depends on `tables`.
+        The tables are invalidated once again when the session commits."""
+        self.written_tables.update(tables)
+        if self.cache is not None:
+            await self.cache.invalidate(*tables)
+
+    async def flush(self, objects: t.Sequence[t.Any] = None) -> None:
+        await super().flush(objects)
+        if self.cache is not None and self.written_tables:
+            await self.cache.invalidate(*self.written_tables)
+
+    async def commit(self) -> None:
+        await super().commit()
+        tables, self.written_tables = self.written_tables, set()
+        if self.cache is not None and tables:
+            await self.cache.invalidate(*tables)
+
+    async def rollback(self) -> None:
+        await super().rollback()
+        self.written_tables.clear()
+
+    def _collect_written_tables(self, session: Session, flush_context: t.Any) -> None:
+        for instance in itertools.chain(session.new, session.dirty, session.deleted):
+            self.written_tables.update(table.fullname for table in inspect(instance).mapper.tables)
+
+    def _collect_executed_tables(self, orm_execute_state: ORMExecuteState) -> None:
+        # INSERT, UPDATE and DELETE statements executed directly do not go through the flush
+        if getattr(orm_execute_state.statement, 'is_dml', False):
+            self.written_tables.update(get_table_names(orm_execute_state.statement))
+
     async def close(self) -> None:
         await super().close()
         DbSession.current_session_stack.get().remove(self)
@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import heapq
+import typing as t
+from collections import OrderedDict, namedtuple
+from sqlalchemy import Boolean, func, inspect
+from sqlalchemy.future import select
+from sqlalchemy.orm import InstrumentedAttribute, joinedload, selectinload
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.sql import Executable, Select, operators
+from sqlalchemy.sql.elements import ColumnElement, UnaryExpression
+from sqlalchemy.sql.functions import FunctionElement
+
+from aerie.base import Base
+from aerie.collections import Collection
+from aerie.database import Aerie
+from aerie.exceptions import NotSupportedError, ShardingError
+from aerie.queries import SelectQuery, _ColumnAggregates
+from aerie.results import ResultProxy
+from aerie.session import DbSession
+from aerie.utils import gather_or_cancel, unwrap_order_by
+
+M = t.TypeVar('M', bound=Base)
+R = t.TypeVar('R')
+
+_ShardKey = t.Union[str, t.Callable[[t.Any], t.Any]]
+_COMBINABLE_AGGREGATES = {'count', 'sum', 'min', 'max', 'avg'}
+
+
+def _hash(value: t.Any) -> int:
+    # Python's hash() is randomized per process, shards must be stable across processes
+    return int(hashlib.sha1(str(value).encode()).hexdigest()[:16], 16)
+
+
+class ShardStrategy:
+    """Base class for strategies mapping shard keys to shard names."""
+
+    def get_shard(self, key: t.Any) -> str:
+        raise NotImplementedError()
+
+
+class HashRing(ShardStrategy):
+    """Consistent hashing. Each shard owns `vnodes` points on the ring, a key belongs to the shard
+    owning the next point clockwise. Adding or removing a shard moves only keys of its neighbours."""
+
+    def __init__(self, shards: t.Iterable[str], vnodes: int = 100) -> None:
+        self.vnodes = vnodes
+        self._points: t.List[int] = []
+        self._shards: t.List[str] = []
+        for shard in shards:
+            self.add_shard(shard)
+
+    def add_shard(self, shard: str) -> None:
+        for index in range(self.vnodes):
+            point = _hash(f'{shard}:{index}')
+            position = bisect.bisect(self._points, point)
+            self._points.insert(position, point)
+            self._shards.insert(position, shard)
+
+    def remove_shard(self, shard: str) -> None:
+        pairs = [(point, name) for point, name in zip(self._points, self._shards) if name != shard]
+        self._points = [point for point, _ in pairs]
+        self._shards = [name for _, name in pairs]
+
+    def get_shard(self, key: t.Any) -> str:
+        if not self._shards:
+            raise ShardingError('The hash ring has no shards.')
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[position]
+
+
+class RangeMap(ShardStrategy):
+    """Map ranges of keys to shards. `ranges` is a list of (lower bound, shard name) tuples,
+    a key belongs to the shard with the greatest lower bound less than or equal to the key."""
+
+    def __init__(self, ranges: t.Iterable[t.Tuple[t.Any, str]]) -> None:
+        ranges = sorted(ranges, key=lambda item: item[0])
+        self._bounds = [bound for bound, _ in ranges]
+        self._shards = [shard for _, shard in ranges]
+
+    def get_shard(self, key: t.Any) -> str:
+        position = bisect.bisect_right(self._bounds, key) - 1
+        if position < 0:
+            raise ShardingError(f'Key "{key}" is below the lowest range.')
+        return self._shards[position]
+
+
+class ShardedAerie:
+    """Routes sessions and statements to one of several Aerie instances by a shard key.
+
+    `shards` is a mapping of shard names to Aerie instances, or names of shared Aerie instances.
+    `shard_key` is the name of a parameter (or model attribute) holding the key,
+    or a function extracting the key from statement parameters (or a model instance).
+    The strategy defaults to consistent hashing over shard names.
+
+    Resolved shards are kept in a LRU cache of `cache_size` keys. During rebalancing,
+    keys can be pinned to their new shards with `pin` before the strategy is changed."""
+
+    def __init__(
+        self,
+        shards: t.Union[t.Mapping[str, Aerie], t.Iterable[str]],
+        shard_key: _ShardKey = None,
+        strategy: ShardStrategy = None,
+        cache_size: int = 10_000,
+    ) -> None:
+        if not isinstance(shards, t.Mapping):
+            shards = {name: Aerie.get_instance(name) for name in shards}
+        self.shards: t.Dict[str, Aerie] = dict(shards)
+        self.shard_key = shard_key
+        self.strategy = strategy or HashRing(self.shards)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[t.Any, str] = OrderedDict()
+        self._pins: t.Dict[t.Any, str] = {}
+
+    def get_shard_name(self, key: t.Any) -> str:
+        if key in self._pins:
+            return self._pins[key]
+
+        name = self._cache.get(key)
+        if name is None:
+            name = self._cache[key] = self.strategy.get_shard(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return name
+
+    def get_shard(self, key: t.Any) -> Aerie:
+        """Return the Aerie instance holding data of the key."""
+        name = self.get_shard_name(key)
+        if name not in self.shards:
+            raise ShardingError(f'Shard "{name}" is not configured.')
+        return self.shards[name]
+
+    def get_key(self, source: t.Any) -> t.Any:
+        """Extract the shard key from statement parameters or a model instance."""
+        if callable(self.shard_key):
+            return self.shard_key(source)
+        if self.shard_key is None:
+            raise ShardingError('Pass the shard key explicitly or configure "shard_key".')
+        if isinstance(source, t.Mapping):
+            if self.shard_key not in source:
+                raise ShardingError(f'Parameters do not contain shard key "{self.shard_key}".')
+            return source[self.shard_key]
+        return getattr(source, self.shard_key)
+
+    def session(self, key: t.Any, **options: t.Any) -> t.AsyncContextManager[DbSession]:
+        """Open a session of the shard holding data of the key.
+        Model queries made inside the session, like `Model.get()`, are executed by this shard."""
+        return self.get_shard(key).session(**options)
+
+    def session_for(self, instance: t.Any, **options: t.Any) -> t.AsyncContextManager[DbSession]:
+        """Open a session of the shard the model instance belongs to."""
+        return self.session(self.get_key(instance), **options)
+
+    def execute(self, stmt: t.Union[str, Executable], params: t.Mapping = None, key: t.Any = None) -> ResultProxy:
+        """Execute the statement on the shard chosen by `key`, or by the shard key found in `params`."""
+        if key is None:
+            key = self.get_key(params or {})
+        return self.get_shard(key).execute(stmt, params)
+
+    def query(self, model: t.Type[M]) -> ShardedQuery[M]:
+        """Build a query executed by every shard, see `ShardedQuery`."""
+        return ShardedQuery(model, list(self.shards.values()))
+
+    def pin(self, key: t.Any, shard: str) -> None:
+        """Route the key to the shard regardless of the strategy, for example, after it has been moved."""
+        self._pins[key] = shard
+
+    def unpin(self, key: t.Any) -> None:
+        self._pins.pop(key, None)
+        self._cache.pop(key, None)
+
+    def set_strategy(self, strategy: ShardStrategy) -> None:
+        """Replace the strategy, for example, after adding a shard. Cached routes are dropped."""
+        self.strategy = strategy
+        self._cache.clear()
+
+
+def _is_distinct(expression: FunctionElement) -> bool:
+    """Test if the aggregate is computed over distinct values, like `count(DISTINCT column)`."""
+    return any(
+        isinstance(clause, UnaryExpression) and clause.operator is operators.distinct_op
+        for clause in expression.clauses
+    )
+
+
+class _Descending:
+    """Inverts ordering of the wrapped sort key part."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: t.Any) -> None:
+        self.value = value
+
+    def __lt__(self, other: _Descending) -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+
+class ShardedQuery(_ColumnAggregates, t.Generic[M]):
+    """A query executed by every shard concurrently (scatter-gather).
+
+    Ordered results are merged with a k-way heap merge. Every shard streams rows in pages,
+    so at most a couple of pages per shard are kept in memory, not the full result sets.
+    The limit (plus offset) is pushed down to every shard, the offset is applied after merging.
+    Counts and aggregates are computed by every shard and combined."""
+
+    def __init__(
+        self,
+        model: t.Type[M],
+        shards: t.Sequence[Aerie],
+        base_stmt: Select = None,
+        limit: int = None,
+        offset: int = 0,
+    ) -> None:
+        self._model: t.Type[M] = model
+        self._shards = shards
+        self._stmt: Select = select(model) if base_stmt is None else base_stmt
+        self._limit = limit
+        self._offset = offset
+
+    def where(self, *conditions: ColumnElement[Boolean]) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.where(*conditions))
+
+    def filter_by(self, **kwargs: t.Any) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.filter_by(**kwargs))
+
+    def join(self, target: t.Type[Base], on_clause: t.Any = None, full: bool = False) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.join(target, onclause=on_clause, full=full))
+
+    def left_join(self, target: t.Type[Base], on_clause: t.Any = None, full: bool = False) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.outerjoin(target, on_clause, full=full))
+
+    def group_by(self, *clauses: ColumnElement) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.group_by(*clauses))
+
+    def order_by(self, *clauses: ColumnElement) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.order_by(*clauses))
+
+    def limit(self, limit: int, offset: int = None) -> ShardedQuery[M]:
+        query = self._clone(limit=limit)
+        if offset:
+            query = query.offset(offset)
+        return query
+
+    def offset(self, offset: int) -> ShardedQuery[M]:
+        return self._clone(offset=offset)
+
+    def options(self, *options: t.Any) -> ShardedQuery[M]:
+        return self._clone(base_stmt=self._stmt.options(*options))
+
+    def preload(self, *cols: InstrumentedAttribute) -> ShardedQuery[M]:
+        return self.options(*[joinedload(col) for col in cols])
+
+    def prefetch(self, *cols: InstrumentedAttribute) -> ShardedQuery[M]:
+        return self.options(*[selectinload(col) for col in cols])
+
+    async def first(self) -> t.Optional[M]:
+        return (await self.limit(1).all()).first()
+
+    async def all(self) -> Collection[M]:
+        return Collection([entity async for entity in self.iterate()])
+
+    async def iterate(self, batch: int = 1000) -> t.AsyncGenerator[M, None]:
+        """Stream merged entities of all shards. Every shard fetches `batch` rows at a time."""
+        if self._limit == 0:
+            return
+        stmt = self._stmt
+        if self._limit is not None:
+            stmt = stmt.limit(self._limit + self._offset)
+            batch = max(1, min(batch, self._limit + self._offset))
+        queues: t.List[asyncio.Queue] = [asyncio.Queue(maxsize=1) for _ in self._shards]
+        tasks = [
+            asyncio.ensure_future(self._stream_shard(shard, stmt, queue, batch))
+            for shard, queue in zip(self._shards, queues)
+        ]
+        merged = self._merge(queues)
+        try:
+            skip, remaining = self._offset, self._limit
+            async for entity in merged:
+                if skip:
+                    skip -= 1
+                    continue
+                yield entity
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining <= 0:
+                        break
+        finally:
+            await merged.aclose()
+            for task in tasks:
+                task.cancel()  # no-op for finished tasks
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _merge(self, queues: t.Sequence[asyncio.Queue]) -> t.AsyncGenerator[M, None]:
+        """Merge ordered pages of entities received from shard queues with a k-way heap merge."""
+        sort_key = self._sort_key()
+        pages: t.List[t.Iterator[M]] = [iter(()) for _ in queues]
+        heap: t.List[t.Tuple[t.Tuple[t.Any, ...], int, M]] = []
+
+        async def advance(index: int) -> None:
+            """Push the next entity of the shard into the heap."""
+            while True:
+                entity = next(pages[index], None)
+                if entity is not None:
+                    heapq.heappush(heap, (sort_key(entity), index, entity))
+                    return
+                page = await queues[index].get()
+                if page is None:
+                    return
+                if isinstance(page, BaseException):
+                    raise page
+                pages[index] = iter(page)
+
+        await asyncio.gather(*[advance(index) for index in range(len(queues))])
+        while heap:
+            _, index, entity = heapq.heappop(heap)
+            yield entity
+            await advance(index)
+
+    async def exists(self) -> bool:
+        return any(await self._run_on_shards(lambda query: query.exists()))
+
+    async def count(self) -> int:
+        """Count matching rows, or groups when the query is grouped, of all shards."""
+        self._ensure_no_having()
+        group_by = list(self._stmt._group_by_clauses)  # type: ignore[attr-defined]
+        if group_by:
+            # a group can have rows on several shards, count distinct group keys
+            groups: t.Set[t.Tuple[t.Any, ...]] = set()
+            for keys in await self._run_on_shards(lambda query: query.values_list(*group_by)):
+                groups.update(keys)
+            total = len(groups)
+        else:
+            total = sum(await self._run_on_shards(lambda query: query.count()))
+        total = max(total - self._offset, 0)
+        return total if self._limit is None else min(total, self._limit)
+
+    async def aggregate(self, **aggregates: ColumnElement) -> t.Any:
+        """Compute aggregates on every shard and combine them, see `SelectQuery.aggregate`.
+        Only count, sum, min, max and avg can be combined; avg is computed from per-shard sums and counts.
+        DISTINCT aggregates, HAVING clauses, limits and offsets are not supported."""
+        self._ensure_no_having()
+        if self._limit is not None or self._offset:
+            raise NotSupportedError('Aggregates of limited queries cannot be combined across shards.')
+
+        shard_aggregates: t.Dict[str, ColumnElement] = {}
+        functions: t.Dict[str, str] = {}
+        for name, expression in aggregates.items():
+            function = expression.name if isinstance(expression, FunctionElement) else None
+            if function not in _COMBINABLE_AGGREGATES or _is_distinct(t.cast(FunctionElement, expression)):
+                raise NotSupportedError(f'Aggregate "{expression}" cannot be combined across shards.')
+            functions[name] = function
+            if function == 'avg':
+                shard_aggregates[f'{name}__sum'] = func.sum(*expression.clauses)
+                shard_aggregates[f'{name}__count'] = func.count(*expression.clauses)
+            else:
+                shard_aggregates[name] = expression
+
+        results = await self._run_on_shards(lambda query: query.aggregate(**shard_aggregates))
+        group_size = len(self._stmt._group_by_clauses)  # type: ignore[attr-defined]
+        if not group_size:
+            return self._combine_aggregates(functions, results)
+
+        groups: t.Dict[t.Tuple[t.Any, ...], t.List[t.Dict[str, t.Any]]] = {}
+        fields: t.List[str] = []
+        for rows in results:
+            for row in rows:
+                fields = list(row._fields[:group_size])
+                groups.setdefault(tuple(row[:group_size]), []).append(dict(row._mapping))
+
+        row_class = namedtuple('AggregateRow', [*fields, *aggregates], rename=True)  # type: ignore[misc]
+        rows = [
+            row_class(*key, *self._combine_aggregates(functions, values).values()) for key, values in groups.items()
+        ]
+        return Collection(rows)
+
+    def _combine_aggregates(
+        self, functions: t.Mapping[str, str], results: t.Sequence[t.Mapping[str, t.Any]]
+    ) -> t.Dict[str, t.Any]:
+        combined: t.Dict[str, t.Any] = {}
+        for name, function in functions.items():
+            if function == 'avg':
+                sums = [result[f'{name}__sum'] for result in results if result[f'{name}__sum'] is not None]
+                count = sum(result[f'{name}__count'] for result in results)
+                combined[name] = sum(sums[1:], sums[0]) / count if count else None
+                continue
+
+            values = [result[name] for result in results if result[name] is not None]
+            if function == 'count':
+                combined[name] = sum(values)
+            elif not values:
+                combined[name] = None
+            elif function == 'sum':
+                combined[name] = sum(values[1:], values[0])
+            else:
+                combined[name] = min(values) if function == 'min' else max(values)
+        return combined
+
+    async def _run_on_shards(self, fn: t.Callable[[SelectQuery[M]], t.Awaitable[R]]) -> t.List[R]:
+        """Run the query on every shard concurrently, each in a new session."""
+
+        async def run(shard: Aerie) -> R:
+            DbSession.current_session_stack.set([])  # do not share the stack with sibling tasks
+            async with shard.session() as session:
+                return await fn(SelectQuery(self._model, session, base_stmt=self._stmt))
+
+        return await gather_or_cancel(run(shard) for shard in self._shards)
+
+    def _ensure_no_having(self) -> None:
+        # HAVING filters per-shard groups, before their rows from other shards are combined
+        if self._stmt._having_criteria:  # type: ignore[attr-defined]
+            raise NotSupportedError('Queries with HAVING clause cannot be combined across shards.')
+
+    async def _stream_shard(self, shard: Aerie, stmt: Select, queue: asyncio.Queue, batch: int) -> None:
+        """Put pages of entities into the queue, then None. The queue holds one page,
+        so the shard fetches the next page only after the merge has taken the previous one."""
+        DbSession.current_session_stack.set([])
+        try:
+            async with shard.session() as session:
+                result = await session.stream(stmt.execution_options(yield_per=batch))
+                async for partition in result.scalars().partitions(batch):  # type: ignore[attr-defined]
+                    for entity in partition:
+                        session.expunge(entity)  # keep memory bounded, entities stay loaded
+                    await queue.put(partition)
+        except Exception as exc:
+            await queue.put(exc)
+        else:
+            await queue.put(None)
+
+    def _sort_key(self) -> t.Callable[[M], t.Tuple[t.Any, ...]]:
+        """Build a function returning a sort key of the entity that matches ORDER BY clause of the query."""
+        mapper = inspect(self._model)
+        nulls_first = self._shards[0].engine.dialect.name != 'postgresql'  # PostgreSQL sorts NULLs as largest values
+        parts: t.List[t.Tuple[str, bool]] = []
+        for clause in self._stmt._order_by_clauses:  # type: ignore[attr-defined]
+            clause, descending, nulls_order = unwrap_order_by(clause)
+            if nulls_order:
+                raise NotSupportedError('NULLS FIRST and NULLS LAST cannot be merged across shards.')
+            try:
+                parts.append((mapper.get_property_by_column(clause).key, descending))
+            except UnmappedColumnError as exc:
+                raise NotSupportedError(f'Cannot merge results ordered by "{clause}" across shards.') from exc
+
+        def sort_key(entity: M) -> t.Tuple[t.Any, ...]:
+            key = []
+            for attribute, descending in parts:
+                value = getattr(entity, attribute)
+                part = ((value is not None) == nulls_first, value)
+                key.append(_Descending(part) if descending else part)
+            return tuple(key)
+
+        return sort_key
+
+    def _clone(self, *, base_stmt: Select = None, limit: int = None, offset: int = None) -> ShardedQuery[M]:
+        return ShardedQuery(
+            model=self._model,
+            shards=self._shards,
+            base_stmt=self._stmt if base_stmt is None else base_stmt,
+            limit=self._limit if limit is None else limit,
+            offset=self._offset if offset is None else offset,
+        )
+
+    def __await__(self) -> t.Generator[t.Any, None, Collection[M]]:
+        return self.all().__await__()
@@ -1,8 +1,14 @@
+import asyncio
 import typing as t
 from contextlib import contextmanager
+from sqlalchemy import Table, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Dialect
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.sql import ClauseElement, ColumnElement, Executable, operators, visitors
+from sqlalchemy.sql.elements import UnaryExpression
 
-from aerie.exceptions import NoResultsError, TooManyResultsError
+from aerie.exceptions import NoResultsError, NotSupportedError, TooManyResultsError
 
 
 @contextmanager
@@ -30,6 +36,153 @@ def chunked(items: t.Iterable[ITEM], size: int) -> t.Generator[t.List[ITEM], Non
         yield result
 
 
+async def achunked(
+    items: t.Union[t.Iterable[ITEM], t.AsyncIterable[ITEM]], size: int
+) -> t.AsyncGenerator[t.List[ITEM], None]:
+    """Like `chunked` but also accepts asynchronous iterables."""
+    if not isinstance(items, t.AsyncIterable):
+        for chunk in chunked(items, size):
+            yield chunk
+        return
+
+    result = []
+    async for value in items:
+        result.append(value)
+        if len(result) == size:
+            yield result
+            result = []
+
+    if len(result):
+        yield result
+
+
+class AsyncStream(t.AsyncIterator[ITEM]):
+    """An async iterator over streamed results which holds a database connection until it is exhausted or closed.
+    Use it as an async context manager to release the connection when the iteration stops early:
+
+        async with db.execute('select * from users').stream() as rows:
+            async for row in rows:
+                ...
+    """
+
+    def __init__(self, iterator: t.AsyncGenerator[ITEM, None]) -> None:
+        self._iterator = iterator
+
+    def __aiter__(self) -> 'AsyncStream[ITEM]':
+        return self
+
+    async def __anext__(self) -> ITEM:
+        return await self._iterator.__anext__()
+
+    async def aclose(self) -> None:
+        """Stop the iteration and release the connection."""
+        await self._iterator.aclose()
+
+    async def __aenter__(self) -> 'AsyncStream[ITEM]':
+        return self
+
+    async def __aexit__(self, *exc_info: t.Any) -> None:
+        await self.aclose()
+
+
+async def gather_or_cancel(awaitables: t.Iterable[t.Awaitable[ITEM]]) -> t.List[ITEM]:
+    """Run awaitables concurrently and return their results in order.
+    When one of them fails, others are cancelled and the exception is raised."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()  # no-op for finished tasks
+        await asyncio.wait(tasks)
+
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()  # type: ignore[misc]
+    return [task.result() for task in tasks]
+
+
+def unwrap_order_by(clause: ColumnElement) -> t.Tuple[ColumnElement, bool, bool]:
+    """Strip ASC, DESC and NULLS FIRST/LAST modifiers of ORDER BY clause.
+    Return the ordered expression, whether it is descending and whether NULLS FIRST/LAST is set."""
+    descending = nulls_order = False
+    while isinstance(clause, UnaryExpression):
+        nulls_order = nulls_order or clause.modifier in (operators.nulls_first_op, operators.nulls_last_op)
+        descending = descending or clause.modifier is operators.desc_op
+        clause = clause.element
+    return clause, descending, nulls_order
+
+
+def get_table_names(stmt: t.Union[ClauseElement, Executable]) -> t.Set[str]:
+    """Return names of all tables the statement refers to, including subqueries."""
+    return {element.fullname for element in visitors.iterate(stmt) if isinstance(element, Table)}
+
+
+def supports_window_functions(dialect: Dialect) -> bool:
+    """Test if the database supports window functions like `count(*) OVER ()`."""
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25)  # type: ignore[attr-defined]
+    return dialect.name == 'postgresql'
+
+
+def supports_returning(dialect: Dialect) -> bool:
+    """Test if the database supports `INSERT ... RETURNING` statements."""
+    return bool(getattr(dialect, 'insert_returning', getattr(dialect, 'full_returning', False)))
+
+
+def get_dialect_insert(dialect: Dialect) -> t.Callable[[Table], t.Any]:
+    """Return a dialect-specific `insert` construct which supports `ON CONFLICT` clauses."""
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert
+    if dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+
+        return insert
+    raise NotSupportedError(f'"{dialect.name}" dialect does not support ON CONFLICT clauses.')
+
+
+LARGE_IN_THRESHOLD = 500
+"""A number of values starting from which IN conditions switch to `large_in` strategy."""
+
+
+def large_in(column: ColumnElement, values: t.Sequence[t.Any], dialect: Dialect) -> t.Optional[ColumnElement]:
+    """Build a `column IN (...)` condition which binds the same number of parameters regardless of `values` length.
+
+    On PostgreSQL, values are passed as a single array parameter: `column = ANY(:values)`.
+    On other databases, integer and string values are rendered inline when the statement is executed,
+    so the database limit on bound parameters does not apply and the compiled statement is cached.
+    Returns None when values cannot be bound this way and have to be chunked by the caller."""
+    values = list(values)
+    if dialect.name == 'postgresql':
+        return column == any_(bindparam(None, values, type_=ARRAY(column.type)))
+    if all(type(value) in (int, str) for value in values):
+        return column.in_(bindparam(None, values, expanding=True, literal_execute=True))
+    return None
+
+
+def in_conditions(
+    column: ColumnElement,
+    values: t.Iterable[t.Any],
+    dialect: Dialect,
+    chunk_size: int = LARGE_IN_THRESHOLD,
+) -> t.Generator[ColumnElement, None, None]:
+    """Yield conditions which together match rows having `column` value in `values`.
+    Short lists produce one plain IN condition, long ones use `large_in`
+    or are split into chunks of `chunk_size` values when it is not applicable."""
+    values = list(values)
+    condition = large_in(column, values, dialect) if len(values) > chunk_size else column.in_(values)
+    if condition is not None:
+        yield condition
+        return
+
+    for chunk in chunked(values, chunk_size):
+        yield column.in_(chunk)
+
+
 def colorize(sql: str) -> str:
     try:
         import pygments
@@ -0,0 +1,49 @@
+import pytest
+
+from aerie.cache import MemoryCache
+
+
+@pytest.mark.asyncio
+async def test_cache_get_set() -> None:
+    cache = MemoryCache()
+    await cache.set('key', 'value')
+    assert await cache.get('key') == 'value'
+    assert await cache.get('missing', 'default') == 'default'
+
+    await cache.delete('key')
+    assert await cache.get('key') is None
+
+
+@pytest.mark.asyncio
+async def test_cache_expires_entries() -> None:
+    cache = MemoryCache()
+    await cache.set('key', 'value', ttl=-1)
+    assert await cache.get('key') is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used() -> None:
+    cache = MemoryCache(max_size=2)
+    await cache.set('one', 1)
+    await cache.set('two', 2)
+    await cache.get('one')
+    await cache.set('three', 3)
+    assert await cache.get('one') == 1
+    assert await cache.get('two') is None
+    assert await cache.get('three') == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidates_tags() -> None:
+    cache = MemoryCache()
+    await cache.set('users', 1, tags=['users'])
+    await cache.set('profiles', 2, tags=['users', 'profiles'])
+    await cache.set('addresses', 3, tags=['addresses'])
+    await cache.invalidate('users')
+    assert await cache.get('users') is None
+    assert await cache.get('profiles') is None
+    assert await cache.get('addresses') == 3
+
+    await cache.clear()
+    assert len(cache) == 0
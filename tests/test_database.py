@@ -1,10 +1,15 @@
+import asyncio
+import io
 import pytest
-from sqlalchemy import text
+import sqlalchemy as sa
+import typing as t
+from sqlalchemy import func, select, text
 from sqlalchemy.exc import DatabaseError
 
-from aerie import Aerie
+from aerie import Aerie, MemoryCache
 from aerie.session import DbSession
 from tests.conftest import databases
+from tests.tables import User, users_table
 
 
 @pytest.mark.asyncio
@@ -64,3 +69,229 @@ def test_shares_instances_requires_unique_names() -> None:
 def test_raises_for_missing_instance() -> None:
     with pytest.raises(KeyError, match='does not exists'):
         Aerie.get_instance('missing')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_streams_rows(db: Aerie) -> None:
+    rows = [row async for row in db.execute('select * from users order by id').stream(batch_size=2)]
+    assert [row.id for row in rows] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_iterates_result_proxy(db: Aerie) -> None:
+    rows = [row async for row in db.execute('select * from users order by id')]
+    assert [row.id for row in rows] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_streams_partitions(db: Aerie) -> None:
+    partitions = [partition async for partition in db.execute('select * from users order by id').partitions(2)]
+    assert [[row.id for row in partition] for partition in partitions] == [[1, 2], [3]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_stream_releases_connection_when_stopped_early(db: Aerie) -> None:
+    checkins = []
+
+    def collect(*args: t.Any) -> None:
+        checkins.append(args)
+
+    sa.event.listen(db.engine.sync_engine, 'checkin', collect)
+    try:
+        async with db.execute('select * from users order by id').stream(batch_size=1) as rows:
+            async for row in rows:
+                assert row.id == 1
+                break
+        assert len(checkins) == 1
+
+        async with db.execute('select * from users order by id').partitions(1) as partitions:
+            async for partition in partitions:
+                assert [row.id for row in partition] == [1]
+                break
+        assert len(checkins) == 2
+    finally:
+        sa.event.remove(db.engine.sync_engine, 'checkin', collect)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_caches_results(db: Aerie) -> None:
+    await db.cache.clear()
+    assert await db.execute(select(users_table.c.name).where(users_table.c.id == 1)).cache().scalar() == 'User One'
+
+    await db.execute(users_table.update().where(users_table.c.id == 1).values(name='updated'))
+    assert await db.execute(select(users_table.c.name).where(users_table.c.id == 1)).cache().scalar() == 'updated'
+
+    await db.execute(users_table.update().where(users_table.c.id == 1).values(name='User One'))
+    assert await db.execute('select name from users where id = 1').cache(tags=['users']).scalar() == 'User One'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_copy_in(db: Aerie) -> None:
+    async def records() -> t.AsyncGenerator[t.Any, None]:
+        for index in range(300, 305):
+            yield (index, f'Copy {index}')
+        yield {'id': 305, 'name': 'Copy 305'}
+
+    try:
+        result = await db.copy_in(User, records(), columns=['id', 'name'], batch_size=2)
+        assert result.rows == 6
+        assert result.rows_per_second > 0
+        assert await db.execute(select(func.count()).where(users_table.c.name.startswith('Copy'))).scalar() == 6
+
+        result = await db.copy_in(users_table, [(306, 'Copy 306')])
+        assert result.rows == 1
+
+        # columns default to keys of the first mapping, the autoincrement id is omitted
+        result = await db.copy_in(users_table, [{'name': 'Copy auto'}, {'name': 'Copy auto'}])
+        assert result.rows == 2
+        assert await db.execute(select(func.count()).where(users_table.c.name == 'Copy auto')).scalar() == 2
+        assert (await db.copy_in(users_table, [])).rows == 0
+    finally:
+        await db.execute(users_table.delete().where(users_table.c.name.startswith('Copy')))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_to_csv(db: Aerie) -> None:
+    writer = io.StringIO()
+    assert await db.execute(select(users_table).order_by(users_table.c.id)).to_csv(writer, batch_size=2) == 3
+    assert writer.getvalue().splitlines() == ['id,name', '1,User One', '2,User Two', '3,User Three']
+
+    writer = io.StringIO()
+    assert await db.copy_out(users_table, writer) == 3
+    assert len(writer.getvalue().splitlines()) == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_to_ndjson(db: Aerie) -> None:
+    class AsyncWriter:
+        def __init__(self) -> None:
+            self.chunks: list[str] = []
+
+        async def write(self, data: str) -> None:
+            self.chunks.append(data)
+
+    writer = AsyncWriter()
+    stmt = select(users_table).where(users_table.c.id < 3).order_by(users_table.c.id)
+    assert await db.execute(stmt).to_ndjson(writer, batch_size=1) == 2
+    assert writer.chunks == ['{"id": 1, "name": "User One"}\n', '{"id": 2, "name": "User Two"}\n']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_connection_scope(db: Aerie) -> None:
+    checkouts = []
+
+    def listener(*args: t.Any) -> None:
+        checkouts.append(args)
+
+    sa.event.listen(db.engine.sync_engine.pool, 'checkout', listener)
+    try:
+        async with db.connection() as scope:
+            assert await scope.execute(select(users_table).where(users_table.c.id == 1)).one()
+            assert await db.execute(select(func.count()).select_from(users_table)).scalar() == 3
+            assert len(await db.execute('select * from users').all()) == 3
+        assert len(checkouts) == 1
+    finally:
+        sa.event.remove(db.engine.sync_engine.pool, 'checkout', listener)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_batch(db: Aerie) -> None:
+    with pytest.raises(ValueError):
+        async with db.batch():
+            await db.execute(users_table.insert().values(id=400, name='Batch'))
+            raise ValueError()
+    assert await db.execute(select(users_table).where(users_table.c.id == 400)).one_or_none() is None
+
+    try:
+        async with db.batch(snapshot=True):
+            await db.execute(users_table.insert().values(id=400, name='Batch'))
+            async with db.batch():
+                assert await db.execute(select(users_table).where(users_table.c.id == 400)).one()
+        assert await db.execute(select(users_table).where(users_table.c.id == 400)).one()
+    finally:
+        await db.execute(users_table.delete().where(users_table.c.id == 400))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_batch_inside_connection_scope(db: Aerie) -> None:
+    async with db.connection():
+        with pytest.raises(ValueError, match='rolled back'):
+            async with db.batch():
+                await db.execute(users_table.insert().values(id=401, name='Batch'))
+                raise ValueError('rolled back')
+        assert await db.execute(select(users_table).where(users_table.c.id == 401)).one_or_none() is None
+
+        with pytest.raises(ValueError, match='connection'):
+            async with db.batch(snapshot=True):
+                pass
+
+        await db.execute(users_table.insert().values(id=401, name='Autocommit'))
+    try:
+        assert await db.execute(select(users_table).where(users_table.c.id == 401)).one()
+    finally:
+        await db.execute(users_table.delete().where(users_table.c.id == 401))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_batch_invalidates_cache_after_commit(db: Aerie) -> None:
+    cache = db.cache
+    assert isinstance(cache, MemoryCache)
+    await cache.clear()
+    query = select(users_table.c.name).where(users_table.c.id == 1)
+    assert await db.execute(query).cache().scalar() == 'User One'
+    try:
+        async with db.batch():
+            await db.execute(users_table.update().where(users_table.c.id == 1).values(name='Uncommitted'))
+            assert len(cache) == 1  # other connections still read committed rows
+            assert await db.execute(query).cache().scalar() == 'Uncommitted'
+        assert len(cache) == 0
+        assert await db.execute(query).cache().scalar() == 'Uncommitted'
+    finally:
+        await db.execute(users_table.update().where(users_table.c.id == 1).values(name='User One'))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases[1:])  # in-memory SQLite shares one connection
+async def test_gather(db: Aerie) -> None:
+    async with db.session() as session:
+        count, users, names = await db.gather(
+            db.execute(select(func.count()).select_from(users_table)),
+            session.query(User).where(User.id < 3).order_by(User.id),
+            lambda session: session.query(User).order_by(User.id).values_list(User.name),
+            limit=2,
+        )
+    assert count[0][0] == 3
+    assert [user.id for user in users] == [1, 2]
+    assert list(names) == [('User One',), ('User Two',), ('User Three',)]
+    assert await db.gather() == []
+    with pytest.raises(ValueError):
+        await db.gather(db.execute('select 1'), limit=0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases[1:])
+async def test_gather_cancels_siblings_on_failure(db: Aerie) -> None:
+    cancelled = asyncio.Event()
+
+    async def slow(session: DbSession) -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(DatabaseError):
+        await db.gather(slow, db.execute('select * from missing_table'))
+    assert cancelled.is_set()
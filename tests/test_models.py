@@ -1,8 +1,15 @@
+import asyncio
 import pytest
 import sqlalchemy as sa
+import typing as t
+from sqlalchemy.orm import ORMExecuteState
 
+from aerie import NoResultsError
+from aerie.cache import CacheStats
 from aerie.database import Aerie
-from tests.tables import AutoBigIntModel, AutoIntModel, User, UserToAddress
+from aerie.models import _entity_cache_stats
+from aerie.utils import LARGE_IN_THRESHOLD
+from tests.tables import AutoBigIntModel, AutoIntModel, User, UserToAddress, users_table
 
 
 @pytest.mark.asyncio
@@ -133,3 +140,216 @@ async def test_repr(db: Aerie) -> None:
         many_pk = await UserToAddress.first()
         assert many_pk
         assert repr(many_pk) == '<UserToAddress: pk=(1, 1)>'
+
+
+@pytest.mark.asyncio
+async def test_model_entity_cache(db: Aerie, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(User, '__cache__', True)
+    monkeypatch.setitem(_entity_cache_stats, User, CacheStats())
+    await db.cache.clear()
+    async with db.session():
+        assert (await User.get(1)).name == 'User One'
+        assert await User.get_or_none(100500) is None
+
+    async with db.session() as session:
+        await session.execute(users_table.update().where(users_table.c.id == 1).values(name='updated'))
+        await session.commit()  # statements executed by the session invalidate cached entities on commit
+
+        user = await User.get(1)
+        assert user.name == 'updated'
+        assert user in session
+        assert await User.get_or_none(100500) is None
+        with pytest.raises(NoResultsError):
+            await User.get(100500)
+        assert User.cache_stats().hits == 1
+        assert User.cache_stats().misses == 4
+
+        user.name = 'changed'
+        await user.save()
+
+    async with db.session():
+        user = await User.get(1)
+        assert user.name == 'changed'
+        assert User.cache_stats().misses == 5
+
+        user.name = 'User One'
+        await user.save()
+
+
+@pytest.mark.asyncio
+async def test_model_destroy_in_batches(db: Aerie) -> None:
+    async with db.session() as session:
+        users = [await User.create(id=100 + index, name='Hundred') for index in range(3)]
+        await User.destroy(*[user.id for user in users], batch_size=2)
+        assert await User.query().where(User.name == 'Hundred').exists() is False
+        assert not any(user in session for user in users)
+
+
+@pytest.mark.asyncio
+async def test_model_destroy_many_keys(db: Aerie) -> None:
+    async with db.session() as session:
+        users = [await User.create(id=1000 + index, name='Many') for index in range(LARGE_IN_THRESHOLD + 10)]
+        await User.destroy(*[user.id for user in users], batch_size=len(users))
+        assert await User.query().where(User.name == 'Many').exists() is False
+        assert not any(user in session for user in users)
+
+
+@pytest.mark.asyncio
+async def test_model_destroy_with_cascade(db: Aerie) -> None:
+    async with db.session():
+        user = await User.create(id=100, name='Hundred')
+        await User.destroy(user.id, cascade=True)
+        assert await User.query().where(User.id == user.id).exists() is False
+
+
+@pytest.mark.asyncio
+async def test_model_bulk_create(db: Aerie) -> None:
+    async with db.session() as session:
+        users = await User.bulk_create([{'name': f'Bulk {index}'} for index in range(5)], batch_size=2)
+        assert len(users) == 5
+        assert all(user.id for user in users)
+        assert all(user in session for user in users)
+        assert await User.query().where(User.name.startswith('Bulk')).count() == 5
+
+        users = await User.bulk_create([{'name': 'No instances'}], return_instances=False)
+        assert users == []
+        assert await User.query().where(User.name == 'No instances').exists()
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_upsert(db: Aerie) -> None:
+    async with db.session() as session:
+        user = await User.get(1)
+        upserted = await User.upsert({'id': 1, 'name': 'Upserted'})
+        assert upserted is user
+        assert user.name == 'Upserted'
+
+        created = await User.upsert({'id': 100, 'name': 'Created'})
+        assert created.id == 100
+        assert created.name == 'Created'
+
+        unchanged = await User.upsert({'id': 100, 'name': 'Ignored'}, update=[])
+        assert unchanged.name == 'Created'
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_upsert_many(db: Aerie) -> None:
+    async with db.session() as session:
+        rows = [{'id': 3, 'name': 'Three'}, {'id': 101, 'name': 'One'}, {'id': 2, 'name': 'Two'}]
+        users = await User.upsert_many(rows, conflict=['id'], batch_size=2)
+        assert [user.id for user in users] == [3, 101, 2]
+        assert [user.name for user in users] == ['Three', 'One', 'Two']
+        assert await User.query().where(User.id.in_([2, 3, 101])).order_by(User.id).choices() == [
+            (2, 'Two'),
+            (3, 'Three'),
+            (101, 'One'),
+        ]
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_get_or_create_with_conflict(db: Aerie) -> None:
+    async with db.session() as session:
+        user, created = await User.get_or_create(None, {'id': 1, 'name': 'Ignored'}, conflict=['id'])
+        assert user.id == 1
+        assert user.name != 'Ignored'
+        assert created is False
+
+        user, created = await User.get_or_create(None, {'id': 102, 'name': 'Created'}, conflict=['id'])
+        assert user.name == 'Created'
+        assert created is True
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_get_or_create_many(db: Aerie) -> None:
+    async with db.session() as session:
+        rows = [{'id': 103, 'name': 'New'}, {'id': 2, 'name': 'Ignored'}, {'id': 104, 'name': 'Another'}]
+        results = await User.get_or_create_many(rows, batch_size=2)
+        assert [(user.id, created) for user, created in results] == [(103, True), (2, False), (104, True)]
+        assert results[1][0].name != 'Ignored'
+
+        results = await User.get_or_create_many(rows)
+        assert [created for _, created in results] == [False, False, False]
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_get_or_create_many_with_concurrent_insert(db: Aerie) -> None:
+    async with db.session() as session:
+
+        def insert_concurrently(state: ORMExecuteState) -> None:
+            if state.is_insert and not inserted:
+                inserted.append(True)  # another task inserts the row right before this call does
+                state.session.execute(users_table.insert().values(id=105, name='Concurrent'))
+
+        inserted: t.List[bool] = []
+        sa.event.listen(session.sync_session, 'do_orm_execute', insert_concurrently)
+        [(user, created)] = await User.get_or_create_many([{'id': 105, 'name': 'Mine'}])
+        assert user.name == 'Concurrent'
+        assert created is False
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_model_batch_loads(db: Aerie, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(User, '__batch_loads__', True)
+    statements = []
+
+    def collect(conn: t.Any, cursor: t.Any, statement: str, *args: t.Any) -> None:
+        statements.append(statement)
+
+    sa.event.listen(db.engine.sync_engine, 'before_cursor_execute', collect)
+    try:
+        async with db.session():
+            users = await asyncio.gather(User.get(1), User.get_or_none(2), User.get(1), User.get_or_none(100500))
+            assert [user.id if user else None for user in users] == [1, 2, 1, None]
+            assert users[0] is users[2]
+            assert len(statements) == 1
+
+            with pytest.raises(NoResultsError):
+                await User.get(100500)
+            assert await User.loader().load_many([3, 1]) == [await User.get(3), users[0]]
+    finally:
+        sa.event.remove(db.engine.sync_engine, 'before_cursor_execute', collect)
+
+
+@pytest.mark.asyncio
+async def test_model_batch_loads_into_loader_session(db: Aerie, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(User, '__batch_loads__', True)
+    async with db.session() as session:
+        task = asyncio.ensure_future(User.get(1))
+        await asyncio.sleep(0)  # the task requests the key, the batch is dispatched on the next loop iteration
+        async with db.session() as other_session:
+            user = await task
+            assert user in session
+            assert user not in other_session
+
+
+@pytest.mark.asyncio
+async def test_model_get_many(db: Aerie) -> None:
+    async with db.session():
+        assert [user.id for user in await User.get_many([3, 100500, 1, 3])] == [3, 1]
+        assert [user.id for user in await User.get_many([3, 1, 2], order='pk')] == [1, 2, 3]
+        assert [user.id for user in await User.get_many(range(1000, 0, -1))] == [3, 2, 1]
+
+        users = await User.get_many_dict([2, 1, 100500])
+        assert {pk: user.id for pk, user in users.items()} == {2: 2, 1: 1}
+
+
+@pytest.mark.asyncio
+async def test_model_bulk_update(db: Aerie) -> None:
+    async with db.session() as session:
+        user = await User.get(2)
+        mappings = [{'id': 1, 'name': 'First'}, {'id': 2, 'name': 'Second'}, {'id': 100500, 'name': 'Missing'}]
+        assert await User.bulk_update(mappings, batch_size=2) == 2
+        assert user.name == 'Second'
+        assert user not in session.dirty
+        assert list(await User.query().order_by(User.id).values_list(User.name)) == [
+            ('First',),
+            ('Second',),
+            ('User Three',),
+        ]
+        await session.rollback()
@@ -1,8 +1,12 @@
+import datetime
+import decimal
 import pytest
 
 from aerie import Aerie, Page
+from aerie.exceptions import InvalidCursorError
+from aerie.paginator import decode_cursor, encode_cursor
 from tests.conftest import databases
-from tests.tables import User
+from tests.tables import Address, User, users_table
 
 
 def test_page() -> None:
@@ -87,3 +91,183 @@ def test_page_str() -> None:
     rows = [1, 2]
     page = Page(rows, total_rows=2, page=1, page_size=2)
     assert str(page) == 'Page 1 of 1, rows 1 - 2 of 2.'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_after(db: Aerie) -> None:
+    async with db.session() as session:
+        page = await session.query(User).paginate_after(page_size=2)
+        assert [user.id for user in page] == [1, 2]
+        assert page.has_next
+        assert not page.has_previous
+
+        page = await session.query(User).paginate_after(page.next_cursor, page_size=2)
+        assert [user.id for user in page] == [3]
+        assert not page.has_next
+        assert page.has_previous
+
+        page = await session.query(User).paginate_after(page.previous_cursor, page_size=2)
+        assert [user.id for user in page] == [1, 2]
+        assert page.has_next
+        assert not page.has_previous
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_after_mixed_directions(db: Aerie) -> None:
+    async with db.session() as session:
+        query = session.query(User).order_by(User.name.desc(), User.id)
+        page = await query.paginate_after(page_size=1)
+        assert [user.name for user in page] == ['User Two']
+
+        page = await query.paginate_after(page.next_cursor, page_size=1)
+        assert [user.name for user in page] == ['User Three']
+
+        page = await query.paginate_after(page.next_cursor, page_size=1)
+        assert [user.name for user in page] == ['User One']
+        assert not page.has_next
+
+        page = await query.paginate_after(page.previous_cursor, page_size=1)
+        assert [user.name for user in page] == ['User Three']
+
+
+@pytest.mark.asyncio
+async def test_paginate_after_invalid_cursor(db: Aerie) -> None:
+    async with db.session() as session:
+        with pytest.raises(InvalidCursorError):
+            await session.query(User).paginate_after('invalid', page_size=1)
+        with pytest.raises(InvalidCursorError):
+            await session.query(User).order_by(User.name).paginate_after(encode_cursor([None, 1]), page_size=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_after_rejects_null_sort_values(db: Aerie) -> None:
+    async with db.session() as session:
+        session.add_all([Address(id=100 + index, city=None, street='') for index in range(3)])
+        await session.flush()
+
+        query = session.query(Address).order_by(Address.city)
+        with pytest.raises(ValueError, match='contains NULL values'):
+            page = await query.paginate_after(page_size=2)
+            while page.next_cursor:
+                page = await query.paginate_after(page.next_cursor, page_size=2)
+        await session.rollback()
+
+
+def test_cursor_encoding() -> None:
+    values = [1, 'name', datetime.datetime(2021, 1, 1, 12), datetime.date(2021, 1, 1), decimal.Decimal('1.5')]
+    assert decode_cursor(encode_cursor(values, backwards=True)) == (values, True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_single_query(db: Aerie) -> None:
+    async with db.session() as session:
+        page = await session.query(User).order_by(User.id).paginate(2, 2, single_query=True)
+        assert page.total_rows == 3
+        assert [user.id for user in page] == [3]
+
+        page = await session.query(User).paginate(3, 2, single_query=True)
+        assert page.total_rows == 3
+        assert len(page) == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases[1:])  # in-memory SQLite shares one connection
+async def test_paginate_concurrently(db: Aerie) -> None:
+    async with db.session() as session:
+        page = await session.query(User).order_by(User.id)._paginate_concurrently(2, 2)
+        assert page.total_rows == 3
+        assert [user.id for user in page] == [3]
+
+
+def test_page_with_inexact_total() -> None:
+    page = Page([1, 2], total_rows=4, page=2, page_size=2, total_is_exact=False, has_more=True)
+    assert page.total_pages == 3
+    assert page.has_next
+    assert page.end_index == 4
+    assert str(page) == 'Page 2 of 3, rows 3 - 4 of 4+.'
+
+    page = Page([1, 2], total_rows=10, page=2, page_size=2, total_is_exact=False, has_more=False)
+    assert page.total_pages == 2
+    assert not page.has_next
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_capped_count(db: Aerie) -> None:
+    async with db.session() as session:
+        page = await session.query(User).order_by(User.id).paginate(1, 1, count='capped', count_limit=2)
+        assert page.total_rows == 2
+        assert not page.total_is_exact
+        assert page.has_next
+        assert [user.id for user in page] == [1]
+
+        page = await session.query(User).order_by(User.id).paginate(3, 1, count='capped', count_limit=2)
+        assert [user.id for user in page] == [3]
+        assert page.total_pages == 3
+        assert not page.has_next
+
+        page = await session.query(User).paginate(1, 1, count='capped', count_limit=10)
+        assert page.total_rows == 3
+        assert page.total_is_exact
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_estimated_count(db: Aerie) -> None:
+    async with db.session() as session:
+        page = await session.query(User).paginate(1, 1, count='estimate', count_limit=2)
+        assert page.total_rows >= 2
+        assert not page.total_is_exact
+        assert page.has_next
+
+        page = await session.query(User).paginate(1, 1, count='estimate', count_limit=10)
+        assert page.total_rows == 3
+        assert page.total_is_exact
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_estimated_count_samples_random_rows(db: Aerie) -> None:
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('SQLite only')
+
+    async with db.session() as session:
+        cities = {index: 'old' if index < 1100 else 'new' for index in range(1000, 1200)}
+        session.add_all([Address(id=index, city=city, street='') for index, city in cities.items()])
+        await session.flush()
+        # matching rows are the most recent ones, a prefix of rowids would contain none of them
+        estimate = await session.query(Address).where(Address.city == 'new')._count_estimate(500)
+        assert 50 <= estimate <= 200
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_paginate_caches_count(db: Aerie) -> None:
+    await db.cache.clear()
+    async with db.session() as session:
+        page = await session.query(User).paginate(1, 2, cache_count=True)
+        assert page.total_rows == 3
+
+        await session.execute(users_table.insert().values(id=10, name='Ten'))
+        await session.commit()  # statements executed by the session invalidate the cached count on commit
+        page = await session.query(User).paginate(1, 2, cache_count=True)
+        assert page.total_rows == 4
+
+        await session.query(User).where(User.id == 10).delete()
+        session.add_all([User(id=11, name='Eleven'), User(id=12, name='Twelve')])
+        page = await session.query(User).paginate(1, 2, cache_count=True)
+        assert page.total_rows == 5  # pending changes bypass the cache
+
+        await session.commit()
+        page = await session.query(User).paginate(1, 2, cache_count=True)
+        assert page.total_rows == 5
+
+        await session.query(User).where(User.id.in_([11, 12])).delete()
+        await session.commit()
+        page = await session.query(User).paginate(1, 2, cache_count=True)
+        assert page.total_rows == 3
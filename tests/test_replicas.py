@@ -0,0 +1,116 @@
+import pathlib
+import pytest
+import sqlalchemy as sa
+import time
+import typing as t
+from sqlalchemy.orm import declarative_base
+
+from aerie import Aerie
+from aerie.replicas import is_read_statement
+
+metadata = sa.MetaData()
+ReplicaBase = declarative_base(metadata=metadata)
+
+
+class Server(ReplicaBase):
+    __tablename__ = 'servers'
+    name = sa.Column(sa.String, primary_key=True)
+
+
+servers_table = Server.__table__
+
+
+async def create_database(url: str, name: str) -> None:
+    engine = Aerie(url, metadata=metadata)
+    await engine.schema.create_tables()
+    await engine.execute(servers_table.insert().values(name=name))
+    await engine.engine.dispose()
+
+
+@pytest.fixture()
+async def db(tmp_path: pathlib.Path) -> t.AsyncGenerator[Aerie, None]:
+    urls = {name: f'sqlite+aiosqlite:///{tmp_path / name}.db' for name in ['primary', 'replica1', 'replica2']}
+    for name, url in urls.items():
+        await create_database(url, name)
+
+    db = Aerie(urls['primary'], replicas=[urls['replica1'], urls['replica2']], metadata=metadata)
+    yield db
+    for engine in [db.engine, *db.replicas]:
+        await engine.dispose()
+
+
+async def read_server(db: Aerie) -> str:
+    return await db.execute('select name from servers').scalar()
+
+
+@pytest.mark.asyncio
+async def test_reads_from_replicas(db: Aerie) -> None:
+    assert {await read_server(db) for _ in range(20)} == {'replica1', 'replica2'}
+    assert await db.execute(sa.select(servers_table.c.name)).scalar() in ['replica1', 'replica2']
+    async with db.transaction() as connection:
+        assert (await connection.execute(sa.select(servers_table.c.name))).scalar() == 'primary'
+    with db.use_primary():
+        assert await read_server(db) == 'primary'
+
+
+@pytest.mark.asyncio
+async def test_reads_from_primary_after_write(db: Aerie) -> None:
+    await db.execute(servers_table.update().values(name='primary'))
+    assert await read_server(db) == 'primary'
+
+    db.router.sticky_window = 0  # type: ignore[union-attr]
+    assert await read_server(db) != 'primary'
+
+
+@pytest.mark.asyncio
+async def test_reads_from_primary_after_transaction(db: Aerie) -> None:
+    async with db.transaction() as connection:
+        await connection.execute(servers_table.insert().values(name='new'))
+    assert await db.execute(sa.select(servers_table.c.name).where(servers_table.c.name == 'new')).scalar() == 'new'
+
+    db.router._last_write_at.set(0.0)  # type: ignore[union-attr]
+    assert await read_server(db) != 'primary'
+    async with db.batch():
+        await db.execute(servers_table.delete().where(servers_table.c.name == 'new'))
+    assert await read_server(db) == 'primary'
+
+
+@pytest.mark.asyncio
+async def test_skips_failed_replica(db: Aerie, tmp_path: pathlib.Path) -> None:
+    db = Aerie(db.url, replicas=[f'sqlite+aiosqlite:///{tmp_path}/missing/replica.db'], metadata=metadata)
+    assert await read_server(db) == 'primary'  # retried on the primary
+    assert db.router.choose_replica() is None  # type: ignore[union-attr]
+
+
+@pytest.mark.asyncio
+async def test_session_reads_from_replicas_until_write(db: Aerie) -> None:
+    async with db.session() as session:
+        server = await session.query(Server).one()  # type: ignore[type-var]  # a separate declarative base
+        assert server.name in ['replica1', 'replica2']
+
+        session.add(Server(name='new'))
+        await session.flush()
+        servers = await session.query(Server).all()  # type: ignore[type-var]
+        assert {server.name for server in servers} == {'primary', 'new'}
+        await session.rollback()
+
+
+def test_is_read_statement() -> None:
+    assert is_read_statement(sa.text('select name from servers'))
+    assert not is_read_statement(sa.text('SELECT name FROM servers FOR UPDATE'))
+    assert not is_read_statement(sa.text('select name from servers for no key update skip locked'))
+    assert not is_read_statement(sa.text('select * from servers for share'))
+    assert not is_read_statement(sa.text("select nextval('servers_id_seq')"))
+    assert is_read_statement(sa.text("select name from servers where name = 'for updates'"))
+    assert not is_read_statement(sa.select(servers_table).with_for_update())
+
+
+@pytest.mark.asyncio
+async def test_failed_replica_backoff_is_capped(db: Aerie) -> None:
+    router = db.router
+    assert router is not None
+    router.max_retry_after = 60
+    replica = router.replicas[0]
+    for _ in range(100):
+        router.mark_failed(replica.engine)
+    assert replica.down_until - time.monotonic() <= 60
@@ -1,11 +1,16 @@
 import io
 import pytest
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql.base import PGDialect
 from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.ext.asyncio import AsyncResult
 
-from aerie import NoResultsError, TooManyResultsError
+from aerie import AerieError, NoResultsError, TooManyResultsError
 from aerie.database import Aerie
+from aerie.queries import BatchProgress
+from aerie.utils import LARGE_IN_THRESHOLD, large_in
 from tests.conftest import databases
-from tests.tables import Address, User
+from tests.tables import Address, Profile, User, users_table
 
 
 @pytest.mark.asyncio
@@ -144,6 +149,70 @@ async def test_delete(db: Aerie) -> None:
         assert await session.query(Address).where(Address.city == '10').exists() is False
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_delete_with_large_in(db: Aerie) -> None:
+    async with db.session() as session:
+        ids = list(range(300, 300 + LARGE_IN_THRESHOLD + 10))
+        session.add_all([Address(id=index, city='large', street='') for index in ids])
+        await session.commit()
+
+        assert await session.query(Address).where(Address.id.in_(ids)).update(street='updated') == len(ids)
+        assert await session.query(Address).where(Address.id.in_(ids)).delete() == len(ids)
+        assert await session.query(Address).where(Address.city == 'large').exists() is False
+
+        # PostgreSQL `id = ANY(:ids)` cannot be evaluated in Python, affected rows are fetched instead
+        query = session.query(Address)
+        assert query._synchronize_session(large_in(Address.id, ids, PGDialect())) == 'fetch'
+        assert query._synchronize_session(Address.id.in_(ids)) == 'evaluate'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_update_and_delete_in_batches(db: Aerie) -> None:
+    async with db.session() as session:
+        session.add_all([Address(id=index, city='batch', street='') for index in range(200, 207)])
+        await session.commit()
+
+        batches: list[BatchProgress] = []
+        query = session.query(Address).where(Address.city == 'batch')
+        assert await query.update(batch_size=3, on_batch=batches.append, city='batched') == 7
+        assert batches == [BatchProgress(1, 3, 202), BatchProgress(2, 6, 205), BatchProgress(3, 7, 206)]
+
+        query = session.query(Address).where(Address.city == 'batched')
+        assert await query.delete(batch_size=3, resume_after=202) == 4
+        assert list(await query.values_list(Address.id)) == [(200,), (201,), (202,)]
+        assert await query.delete(batch_size=3) == 3
+        assert await query.exists() is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_batches_reject_pending_changes(db: Aerie) -> None:
+    async with db.session() as session:
+        session.add(Address(id=210, city='pending', street=''))
+        with pytest.raises(AerieError, match='pending changes'):
+            await session.query(Address).where(Address.city == 'batch').delete(batch_size=3)
+        await session.rollback()
+        assert await session.query(Address).where(Address.city == 'pending').exists() is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_update_and_delete_in_large_batches(db: Aerie) -> None:
+    async with db.session() as session:
+        ids = range(2000, 2000 + LARGE_IN_THRESHOLD * 2)
+        session.add_all([Address(id=index, city='large batch', street='') for index in ids])
+        await session.commit()
+
+        query = session.query(Address).where(Address.city == 'large batch')
+        # values can be passed as a mapping, so columns may be named like options
+        assert await query.update({'street': 'updated'}, batch_size=len(ids)) == len(ids)
+        assert await query.where(Address.street == 'updated').count() == len(ids)
+        assert await query.delete(batch_size=LARGE_IN_THRESHOLD + 1) == len(ids)
+        assert await query.exists() is False
+
+
 @pytest.mark.asyncio
 async def test_to_string(db: Aerie) -> None:
     async with db.session() as session:
@@ -178,3 +247,152 @@ async def test_only_with_strings(db: Aerie) -> None:
         assert user.id == 1
         with pytest.raises(MissingGreenlet):
             assert user.name
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_iterate(db: Aerie) -> None:
+    async with db.session() as session:
+        users = [user async for user in session.query(User).order_by(User.id).iterate(batch=2)]
+        assert [user.id for user in users] == [1, 2, 3]
+        assert not any(user in session for user in users)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_iterate_keeps_modified_entities(db: Aerie) -> None:
+    async with db.session() as session:
+        async for user in session.query(User).order_by(User.id).iterate(batch=2):
+            if user.id == 1:
+                user.name = 'changed'
+        user = await session.query(User).where(User.id == 1).one()
+        assert user.name == 'changed'
+        await session.rollback()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_iterate_closes_result_when_stopped_early(db: Aerie, monkeypatch: pytest.MonkeyPatch) -> None:
+    closed = []
+    close = AsyncResult.close
+
+    async def spy(result: AsyncResult) -> None:
+        closed.append(result)
+        await close(result)
+
+    monkeypatch.setattr(AsyncResult, 'close', spy)
+    async with db.session() as session:
+        async with session.query(User).order_by(User.id).iterate(batch=1) as users:
+            async for user in users:
+                assert user.id == 1
+                break
+        assert len(closed) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_aggregates(db: Aerie) -> None:
+    async with db.session() as session:
+        query = session.query(User).order_by(User.name)
+        assert await query.sum(User.id) == 6
+        assert await query.avg('id') == 2
+        assert await query.min(User.id) == 1
+        assert await query.max(User.id) == 3
+        assert await query.where(User.id > 1).aggregate(total=func.sum(User.id), count=func.count()) == {
+            'total': 5,
+            'count': 2,
+        }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_aggregates_respect_limit_and_distinct(db: Aerie) -> None:
+    async with db.session() as session:
+        query = session.query(User).order_by(User.id)
+        assert await query.limit(2).sum(User.id) == 3
+        assert await query.limit(2, offset=1).aggregate(total=func.sum(User.id), count=func.count()) == {
+            'total': 5,
+            'count': 2,
+        }
+        assert await query.offset(2).max('id') == 3
+        distinct = query._clone(base_stmt=query._stmt.distinct())
+        assert await distinct.sum(User.id) == 6
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_grouped_aggregates(db: Aerie) -> None:
+    async with db.session() as session:
+        query = session.query(Profile).group_by(Profile.first_name).having(func.count() > 1)
+        rows = await query.aggregate(count=func.count(), max_id=func.max(Profile.id))
+        assert [(row.first_name, row.count, row.max_id) for row in rows] == [('User', 2, 2)]
+        assert await query.sum(Profile.id) == {'User': 3}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_values(db: Aerie) -> None:
+    async with db.session() as session:
+        rows = await session.query(User).order_by(User.id).values('id', User.name)
+        assert [dict(row) for row in rows] == [
+            {'id': 1, 'name': 'User One'},
+            {'id': 2, 'name': 'User Two'},
+            {'id': 3, 'name': 'User Three'},
+        ]
+        assert len(session.identity_map) == 0
+
+        rows = await session.query(User).where(User.id == 1).values()
+        assert dict(rows[0]) == {'id': 1, 'name': 'User One'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_values_list(db: Aerie) -> None:
+    async with db.session() as session:
+        rows = await session.query(User).order_by(User.id).values_list(User.id, 'name')
+        assert list(rows) == [(1, 'User One'), (2, 'User Two'), (3, 'User Three')]
+        assert list(await session.query(User).where(User.id == 1).tuples('id')) == [(1,)]
+        assert len(session.identity_map) == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('db', databases)
+async def test_cache(db: Aerie) -> None:
+    await db.cache.clear()
+    async with db.session() as session:
+        users = await session.query(User).order_by(User.id).cache(key='users').all()
+        assert len(users) == 3
+        users[0].name = 'changed'  # local changes do not leak into the cache
+        await session.rollback()
+
+    async with db.session() as session:
+        await session.execute(users_table.update().where(users_table.c.id == 1).values(name='updated'))
+        await session.commit()  # statements executed by the session invalidate the cache on commit
+
+        users = await session.query(User).order_by(User.id).cache(key='users').all()
+        assert users[0].name == 'updated'
+        assert users[0] in session
+
+        await session.query(User).where(User.id == 1).update(name='User One')
+        await session.commit()
+
+    async with db.session() as session:
+        assert (await session.query(User).order_by(User.id).cache(key='users').all())[0].name == 'User One'
+        await session.execute(update(User).where(User.id == 1).values(name='changed'))
+        await session.commit()
+
+    async with db.session() as session:
+        users = await session.query(User).order_by(User.id).cache(key='users').all()
+        assert users[0].name == 'changed'
+
+        await session.query(User).where(User.id == 1).update(name='User One')
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_where_with_large_in(db: Aerie) -> None:
+    async with db.session() as session:
+        query = session.query(User).where(User.id.in_(list(range(1, 1001))))
+        assert query._stmt.whereclause.right.literal_execute
+        assert await query.count() == 3
+        assert await session.query(User).where(User.name.in_([f'User {i}' for i in range(1000)] + ['User One'])).count()
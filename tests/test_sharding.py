@@ -0,0 +1,148 @@
+import pathlib
+import pytest
+import typing as t
+from sqlalchemy import func
+
+from aerie import Aerie, HashRing, RangeMap, ShardedAerie, ShardingError
+from aerie.exceptions import NotSupportedError
+from tests.tables import User
+
+
+@pytest.fixture()
+async def sharded(tmp_path: pathlib.Path) -> t.AsyncGenerator[ShardedAerie, None]:
+    shards = {name: Aerie(f'sqlite+aiosqlite:///{tmp_path / name}.db') for name in ['a', 'b']}
+    for shard in shards.values():
+        await shard.schema.create_tables()
+
+    yield ShardedAerie(shards, shard_key='id', strategy=RangeMap([(0, 'a'), (100, 'b')]))
+    for shard in shards.values():
+        await shard.engine.dispose()
+
+
+def test_hash_ring_moves_few_keys() -> None:
+    ring = HashRing(['a', 'b', 'c'])
+    before = {key: ring.get_shard(key) for key in range(1000)}
+    assert set(before.values()) == {'a', 'b', 'c'}
+    assert before == {key: HashRing(['c', 'a', 'b']).get_shard(key) for key in range(1000)}
+
+    ring.add_shard('d')
+    moved = [key for key in range(1000) if ring.get_shard(key) != before[key]]
+    assert all(ring.get_shard(key) == 'd' for key in moved)
+    assert 100 < len(moved) < 400
+
+    ring.remove_shard('d')
+    assert before == {key: ring.get_shard(key) for key in range(1000)}
+
+
+def test_range_map() -> None:
+    ranges = RangeMap([(100, 'b'), (0, 'a')])
+    assert ranges.get_shard(0) == 'a'
+    assert ranges.get_shard(99) == 'a'
+    assert ranges.get_shard(100) == 'b'
+    with pytest.raises(ShardingError):
+        ranges.get_shard(-1)
+
+
+def test_lookup_cache_and_pins() -> None:
+    db = Aerie('sqlite+aiosqlite:///:memory:')
+    sharded = ShardedAerie({'a': db, 'b': db}, strategy=RangeMap([(0, 'a'), (100, 'b')]), cache_size=2)
+    assert [sharded.get_shard_name(key) for key in [1, 2, 101]] == ['a', 'a', 'b']
+    assert list(sharded._cache) == [2, 101]
+
+    sharded.pin(1, 'b')
+    assert sharded.get_shard_name(1) == 'b'
+    sharded.unpin(1)
+    assert sharded.get_shard_name(1) == 'a'
+
+    sharded.set_strategy(RangeMap([(0, 'b')]))
+    assert sharded.get_shard_name(1) == 'b'
+
+    sharded.pin(1, 'c')
+    with pytest.raises(ShardingError):
+        sharded.get_shard(1)
+
+
+@pytest.mark.asyncio
+async def test_routes_statements_and_sessions(sharded: ShardedAerie) -> None:
+    await sharded.execute(User.__table__.insert(), {'id': 1, 'name': 'one'})
+    await sharded.execute(User.__table__.insert(), {'id': 200, 'name': 'two hundred'})
+    async with sharded.session_for(User(id=300)) as session:
+        session.add(User(id=300, name='three hundred'))
+        await session.commit()
+
+    assert await sharded.shards['a'].execute('select count(*) from users').scalar() == 1
+    assert await sharded.shards['b'].execute('select count(*) from users').scalar() == 2
+    assert list(await sharded.execute('select id from users order by id', key=200).scalars()) == [200, 300]
+
+    async with sharded.session(200):
+        assert (await User.get(300)).name == 'three hundred'
+        assert await User.get_or_none(1) is None
+
+    with pytest.raises(ShardingError):
+        sharded.execute('select 1')
+
+
+async def insert_users(sharded: ShardedAerie) -> None:
+    names = {1: 'b', 2: 'd', 3: None, 101: 'a', 102: 'c', 103: 'e', 104: 'c'}
+    for user_id, name in names.items():
+        await sharded.execute(User.__table__.insert(), {'id': user_id, 'name': name})
+
+
+@pytest.mark.asyncio
+async def test_query_merges_ordered_results(sharded: ShardedAerie) -> None:
+    await insert_users(sharded)
+    query = sharded.query(User).where(User.name.isnot(None))
+    assert [user.name for user in await query.order_by(User.name, User.id)] == ['a', 'b', 'c', 'c', 'd', 'e']
+    assert [user.id for user in await query.order_by(User.name.desc(), User.id.desc())] == [103, 2, 104, 102, 1, 101]
+    assert [user.id for user in await query.order_by(User.name, User.id).limit(3, offset=2)] == [102, 104, 2]
+    assert (await query.order_by(User.name).offset(5).first()).name == 'e'  # type: ignore[union-attr]
+    assert [user.id async for user in query.order_by(User.id).iterate(batch=1)] == [1, 2, 101, 102, 103, 104]
+    assert [user.name for user in await sharded.query(User).order_by(User.name)][:2] == [None, 'a']
+
+
+@pytest.mark.asyncio
+async def test_query_combines_counts_and_aggregates(sharded: ShardedAerie) -> None:
+    await insert_users(sharded)
+    query = sharded.query(User)
+    assert await query.count() == 7
+    assert await query.limit(3, offset=2).count() == 3
+    assert await query.offset(6).count() == 1
+    assert await query.where(User.id > 500).exists() is False
+    assert await query.sum('id') == 416
+    assert await query.avg(User.id) == pytest.approx(416 / 7)
+    assert await query.min('name') == 'a'
+    assert await query.where(User.id > 500).max('id') is None
+    assert await query.aggregate(users=func.count(), top=func.max(User.id)) == {'users': 7, 'top': 104}
+
+    grouped = sharded.query(User).where(User.name.isnot(None)).group_by(User.name)
+    assert await grouped.sum('id') == {'a': 101, 'b': 1, 'c': 206, 'd': 2, 'e': 103}
+    rows = await grouped.aggregate(users=func.count(), average=func.avg(User.id))
+    assert sorted((row.name, row.users, row.average) for row in rows) == [
+        ('a', 1, 101),
+        ('b', 1, 1),
+        ('c', 2, 103),
+        ('d', 1, 2),
+        ('e', 1, 103),
+    ]
+
+    with pytest.raises(NotSupportedError):
+        await query.aggregate(names=func.group_concat(User.name))
+
+
+@pytest.mark.asyncio
+async def test_query_rejects_uncombinable_aggregates(sharded: ShardedAerie) -> None:
+    await insert_users(sharded)
+    await sharded.execute(User.__table__.insert(), {'id': 4, 'name': 'c'})  # group "c" is on both shards
+    grouped = sharded.query(User).where(User.name.isnot(None)).group_by(User.name)
+    assert await grouped.count() == 5
+    assert list(await sharded.query(User).limit(0).all()) == []
+
+    having = grouped._clone(base_stmt=grouped._stmt.having(func.count() > 1))
+    with pytest.raises(NotSupportedError):
+        await having.count()
+    with pytest.raises(NotSupportedError):
+        await having.aggregate(users=func.count())
+    with pytest.raises(NotSupportedError):
+        await grouped.aggregate(names=func.count(User.name.distinct()))
+    with pytest.raises(NotSupportedError):
+        await sharded.query(User).limit(2).sum('id')